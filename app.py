@@ -1,17 +1,22 @@
 import os
+import sys
+import time
+
+# Only what every page needs is imported up front; B2/boto3, scipy, pydeck
+# and the model/VADER stack are imported by the page that uses them
+_import_start = time.perf_counter()
 import pandas as pd
 import streamlit as st
-import pydeck as pdk
-import pickle
-from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
-from sklearn.linear_model import LinearRegression
-from sklearn.preprocessing import StandardScaler
-from utils.modeling_sentiment import encode_property_type, load_model
-import sys
-from utils.b2 import B2
-from dotenv import load_dotenv
-from io import BytesIO
-from utils.basic_clean import *
+from utils.snapshot import SnapshotRefresher
+from utils.search import ListingIndex, QueryCache
+from utils.geo import GeoGrid
+from utils.results import DISPLAY_COLUMNS, ResultCursor, preview_frame
+from utils.basic_clean import PROPERTY_CATEGORIES
+from utils.model_registry import ModelRegistry
+from utils import metrics
+from utils.metrics import timed, timer
+if metrics.ENABLED:
+    metrics.observe('app_imports', time.perf_counter() - _import_start)
 
 # Set the page config for a wide layout
 st.set_page_config(page_title="Airbnb Data Viewer", layout="wide", initial_sidebar_state="expanded")
@@ -20,47 +25,150 @@ st.set_page_config(page_title="Airbnb Data Viewer", layout="wide", initial_sideb
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), 'utils')))
 
 
-# Load Backblaze from Streamlit Secrets
-endpoint = os.getenv("B2_ENDPOINT")  
-key_id = os.getenv("B2_KEYID")
-app_key = os.getenv("B2_APPKEY")
-bucket_name = os.getenv("B2_BUCKETNAME")
-
-# Set up Backblaze connection
-b2 = B2(
-    endpoint=endpoint,
-    key_id=key_id,
-    secret_key=app_key
-)
-
-@st.cache_data 
-def fetch_data():
+# Structures derived from LISTINGS_FILE kept across its recent versions, a few per version.
+# A city's live on its shard instead and are bounded by the shard memory budget
+SNAPSHOT_CACHE_ENTRIES = 16
+
+# The Backblaze client is only built once the bucket is contacted: to list the cities, or
+# to check for (or download) a listing file no local snapshot covers
+@st.cache_resource
+def get_bucket():
+    from utils.b2 import B2
+
+    # Load Backblaze from Streamlit Secrets
+    b2 = B2(
+        endpoint=os.getenv("B2_ENDPOINT"),
+        key_id=os.getenv("B2_KEYID"),
+        secret_key=os.getenv("B2_APPKEY")
+    )
+    b2.set_bucket(os.getenv('B2_BUCKETNAME'))
+    return b2
+
+# Shared by every session: the snapshot is read-only and memory-mapped from disk.
+# A background thread checks the file's ETag every AIRBNB_REFRESH_SECONDS and swaps
+# in a new snapshot once it is converted, so no rerun waits on a download. A snapshot
+# already on disk is served straight away, Backblaze is only connected to for the check
+@st.cache_resource
+def get_refresher():
+    # A CSV/Parquet LISTINGS_FILE is streamed in chunks with only the columns we use
+    return SnapshotRefresher(get_bucket, os.getenv('LISTINGS_FILE', 'Cleaned_Austin_AirBnB.xlsx')).start()  #Exact Name of File
+
+def fetch_snapshot():
     try:
-        b2.set_bucket(os.getenv('B2_BUCKETNAME'))  
-        obj = b2.get_object('Cleaned_Austin_AirBnB.xlsx')  #Exact Name of File
-
-        # Convert the StreamingBody object to a BytesIO object
-        # Done to combat Error
-        file_content = obj.read()  # Read the content of the StreamingBody
-        return pd.read_excel(BytesIO(file_content))  # Use BytesIO to create a file-like object
+        return get_refresher().current
     except Exception as e:
         st.error(f"Error fetching data from Backblaze: {e}")
         return None
 
+# Per-city shards under LISTINGS_PREFIX in the bucket; None when there are none
+@st.cache_resource
+def get_shard_catalog():
+    try:
+        from utils.shards import ShardCatalog
+        catalog = ShardCatalog(get_bucket())
+    except Exception:
+        return None
+    return catalog if catalog.shards else None
+
+def select_listings():
+    """
+    The listings a page shows: `(catalog, city, snapshot, data, source)`.
+
+    Only the pages that show listings call this, so the Seller Page and the
+    text-only tabs never touch Backblaze. When the bucket is sharded by city
+    one city is picked in the sidebar.
+    """
+    catalog = get_shard_catalog()
+    city = st.sidebar.selectbox("City", catalog.cities()) if catalog is not None else None
+    snapshot = fetch_data(city)
+    data = snapshot.data if snapshot is not None else None
+    source = catalog.shards[city] if city else os.getenv('LISTINGS_FILE', 'Cleaned_Austin_AirBnB.xlsx')
+    return catalog, city, snapshot, data, source
+
+@timed('fetch_data')
+def fetch_data(city=None):
+    """The listing snapshot of `city`, or of LISTINGS_FILE when the bucket has no city shards."""
+    catalog = get_shard_catalog() if city else None
+    if catalog is None:
+        return fetch_snapshot()
+    try:
+        # Loaded on first use; the least recently used cities are dropped past the memory budget
+        return catalog.shard(city).snapshot
+    except Exception as e:
+        st.error(f"Error fetching the {city} listings from Backblaze: {e}")
+        return None
 
-def get_sentiment_score(text, analyzer):
-    """Utility function to get sentiment score using SentimentIntensityAnalyzer."""
+# Built once per snapshot. A city's structures are kept on its shard, so evicting the
+# shard releases them too; those of LISTINGS_FILE are cached per version, the
+# DataFrame itself is not hashed
+def snapshot_resource(city, name, build, version, data):
+    if city:
+        shard = get_shard_catalog().shard(city)
+        if shard.snapshot.version == version:
+            return shard.derived(name, lambda: build(data))
+        # The shard was reloaded with a newer file since `data` was fetched
+        return build(data)
+    return get_versioned_resource(name, version, data, build)
+
+@st.cache_resource(max_entries=SNAPSHOT_CACHE_ENTRIES)
+def get_versioned_resource(name, version, _data, _build):
+    return _build(_data)
+
+def get_listing_index(city, version, data):
+    return snapshot_resource(city, 'listing_index', ListingIndex, version, data)
+
+# Buyer Page search results shared by every session, as row positions per snapshot version
+@st.cache_resource
+def get_query_cache():
+    return QueryCache()
+
+def get_geo_grid(city, version, data):
+    return snapshot_resource(city, 'geo_grid', GeoGrid, version, data)
+
+def build_spatial_index(data):
+    # scipy is only needed once a location search is used
+    from utils.spatial import SpatialIndex
+    return SpatialIndex(data)
+
+def get_spatial_index(city, version, data):
+    return snapshot_resource(city, 'spatial_index', build_spatial_index, version, data)
+
+# Insight cubes: the ones built offline by utils/cubes.py for this snapshot, or derived once
+# from the previous snapshot's cubes (or aggregated from scratch) and saved for the next run
+def build_insight_cubes(data, version, source):
+    from utils.cubes import load_cubes, update_cubes
+    cubes = load_cubes(source, version)
+    if cubes is None:
+        cubes = update_cubes(source, version, data)
+    return cubes
+
+def get_cubes(city, version, data, source):
+    return snapshot_resource(city, 'cubes', lambda d: build_insight_cubes(d, version, source), version, data)
+
+# Display transforms such as the id truncation run once per snapshot, not per render
+def get_preview(city, version, data):
+    return snapshot_resource(city, 'preview', preview_frame, version, data)
+
+@timed('get_sentiment_score')
+def get_sentiment_score(text):
+    """Utility function to get sentiment score using the shared SentimentIntensityAnalyzer."""
     if text:
-        sentiment = analyzer.polarity_scores(text)
-        return sentiment['compound']
+        # Memoized, so reruns that only change a numeric field don't rescore;
+        # VADER itself is loaded on the first call
+        from utils.sentiment import cached_compound
+        return cached_compound(text)
     return 0 # Default sentiment score if text is missing
 
-# Load trained model from pickle file
-try:
-    model, scaler, expected_features = load_model()
-except FileNotFoundError:
-    st.error("Model file not found. Please add the trained model.pickle.")
-    st.stop()
+# Active model version, re-read when current.json is swapped by a retrain
+model_registry = ModelRegistry()
+
+# Scaler folded into the model coefficients, one per model version, shared by every session
+@st.cache_resource
+def get_scorer(version):
+    from utils.batch_predict import BatchScorer
+    from utils.modeling_sentiment import load_model
+    model, scaler, expected_features = load_model(version)
+    return BatchScorer(model, scaler, expected_features)
 
 # Streamlit UI
 # Initialize session state variables
@@ -128,15 +236,17 @@ def main():
     # Navigation
     navigation = st.sidebar.selectbox("Navigate", ["Main", "Buyer Page", "Seller Page"])
 
-    # Fetch data
-    data = fetch_data()
+    # Fetch data, only for the pages that show listings
+    data = None
+    if navigation == "Buyer Page":
+        catalog, city, snapshot, data, source = select_listings()
 
     # Main Page Content with Tabs
     if navigation == "Main":
         st.header("Welcome to the Airbnb Data Explorer")
 
         # Tab system
-        tab = st.selectbox("Select a section", ["Introduction", "Goals and Approach", "Data Preview"])
+        tab = st.selectbox("Select a section", ["Introduction", "Goals and Approach", "Data Preview", "Insights"])
 
         if tab == "Introduction":
             st.markdown('<p class="sub-title">Introduction</p>', unsafe_allow_html=True)
@@ -170,14 +280,44 @@ def main():
             """, unsafe_allow_html=True)
 
         elif tab == "Data Preview":
-            if data is not None and 'id' in data.columns:
-                # Convert 'id' to integer, then keep only the first five digits
-                data['id'] = data['id'].apply(lambda x: str(int(float(x)))[:5])
-
             # Display data on the main page
+            catalog, city, snapshot, data, source = select_listings()
             if data is not None:
+                # First rows with 'id' cut to its first five digits, built once per snapshot
+                preview = get_preview(city, snapshot.version, data)
                 st.write("Data loaded successfully.")
-                st.dataframe(data.head())
+                st.dataframe(preview)
+            else:
+                st.write("Failed to load data.")
+
+        elif tab == "Insights":
+            catalog, city, snapshot, data, source = select_listings()
+            if data is not None:
+                # Every table below is a lookup in the precomputed cubes, not a pass over the listings
+                cubes = get_cubes(city, snapshot.version, data, source)
+                category = st.selectbox("Property Category", ["Any"] + PROPERTY_CATEGORIES)
+                category = None if category == "Any" else category
+
+                st.markdown('<p class="sub-title">Neighborhood Hotspots</p>', unsafe_allow_html=True)
+                st.dataframe(cubes.hotspots(property_category=category))
+
+                st.markdown('<p class="sub-title">Price Sweet Spot</p>', unsafe_allow_html=True)
+                price_ranges = cubes.price_ranges(property_category=category)
+                st.bar_chart(price_ranges['mean_rating'])
+                st.dataframe(price_ranges)
+
+                st.markdown('<p class="sub-title">Amenity Impact</p>', unsafe_allow_html=True)
+                if len(cubes.amenity.table):
+                    st.dataframe(cubes.amenity_impact())
+                else:
+                    st.write("The listing data has no amenities column.")
+
+                if catalog is not None and len(catalog.shards) > 1:
+                    # Each city is reduced on its own, in parallel, then combined
+                    st.markdown('<p class="sub-title">Compare Cities</p>', unsafe_allow_html=True)
+                    compare = st.multiselect("Cities", catalog.cities(), default=[city])
+                    if compare:
+                        st.dataframe(catalog.aggregate(compare), hide_index=True)
             else:
                 st.write("Failed to load data.")
 
@@ -199,70 +339,114 @@ def main():
                 st.empty()
         except ValueError as e:
             st.error(e)
-        unique_property_types = (
-            ["Any"] + sorted(data['property_type'].dropna().unique().tolist()) 
-            if 'property_type' in data.columns else ["Any"]
-        )
+        index = get_listing_index(city, snapshot.version, data)
+
+        unique_property_types = ["Any"] + index.values('property_type')
         selected_property_type = st.selectbox("Property Type", options=unique_property_types)
 
-        unique_bedrooms = (
-            sorted(data['bedrooms'].dropna().unique()) 
-            if 'bedrooms' in data.columns else []
-        )
+        unique_bedrooms = index.values('bedrooms')
         selected_bedrooms = st.selectbox("Number of Bedrooms", options=unique_bedrooms)
 
+        # Optional "near this point" search on top of the other filters
+        near_mode = "Off"
+        if 'latitude' in data.columns and 'longitude' in data.columns:
+            near_mode = st.radio("Near This Point", ["Off", "Within Radius", "Closest Listings"], horizontal=True)
+            if near_mode != "Off":
+                spatial = get_spatial_index(city, snapshot.version, data)
+                near_latitude = st.number_input("Latitude", value=spatial.center[0], format="%.5f")
+                near_longitude = st.number_input("Longitude", value=spatial.center[1], format="%.5f")
+                if near_mode == "Within Radius":
+                    radius_km = st.number_input("Radius (km)", min_value=0.1, value=2.0, step=0.5)
+                else:
+                    nearest_count = st.number_input("Number of Listings", min_value=1, max_value=500, value=20, step=1)
+
+        map_zoom = st.select_slider("Map Zoom", options=[8, 10, 12, 14, 16], value=10)
+
         search_button = st.button("Search")
 
         if search_button:
             st.empty()
-            filtered_data = data.copy()
-
-            # Filter by rating
-            if 'review_scores_rating' in filtered_data.columns:
-                filtered_data = filtered_data[filtered_data['review_scores_rating'] >= rating_input]
-
-            # Filter by property type
-            if selected_property_type != "Any" and 'property_type' in filtered_data.columns:
-                filtered_data = filtered_data[filtered_data['property_type'] == selected_property_type]
-
-            # Filter by price
-            if 'price' in filtered_data.columns:
-                filtered_data = filtered_data[filtered_data['price'] <= price_input]
 
-            # Filter by bedrooms
-            if 'bedrooms' in filtered_data.columns:
-                filtered_data = filtered_data[filtered_data['bedrooms'] == selected_bedrooms]
+            # Filter by rating, property type, price, bedrooms and location through the prebuilt indexes
+            with timer('buyer_search'):
+                criteria = dict(
+                    min_rating=rating_input,
+                    max_price=price_input,
+                    property_type=selected_property_type,
+                    bedrooms=selected_bedrooms
+                )
+                if near_mode == "Within Radius":
+                    within = spatial.radius(near_latitude, near_longitude, radius_km)
+                    matches = index.search(within=within, **criteria)
+                else:
+                    # Popular searches are answered from the shared cache until the snapshot changes
+                    matches = get_query_cache().search(index, snapshot.version, source, **criteria)
+                if near_mode == "Closest Listings":
+                    # Closest first
+                    matches, _ = spatial.nearest(near_latitude, near_longitude, nearest_count, candidates=matches)
+            # Only the matching row positions are kept for the session, pages are sliced on each render
+            st.session_state['buyer_results'] = ResultCursor(matches, snapshot.version)
+            st.session_state['buyer_page'] = 1
+
+        results = st.session_state.get('buyer_results')
+        if results is not None and results.version == snapshot.version:
+            matches = results.positions
 
             # Display filtered data
-            if len(filtered_data) > 0:
-                st.write(f"Found {len(filtered_data)} properties based on your search criteria.")
-                st.dataframe(filtered_data[['review_scores_rating', 'name', 'listing_url', 'price', 'bedrooms']])
+            if len(results) > 0:
+                st.write(f"Found {len(results)} properties based on your search criteria.")
+
+                # Sorting and paging happen on the server, only one page is sent to the browser
+                sort_columns = [c for c in DISPLAY_COLUMNS if c in data.columns]
+                sort_col, order_col, page_col = st.columns(3)
+                sort_by = sort_col.selectbox("Sort By", ["Default"] + sort_columns)
+                ascending = order_col.radio("Order", ["Ascending", "Descending"], horizontal=True) == "Ascending"
+                page = page_col.number_input("Page", min_value=1, max_value=results.pages, step=1, key='buyer_page')
+                page_col.caption(f"{results.pages} pages of {results.page_size} listings")
+                with timer('buyer_table'):
+                    st.dataframe(results.page(
+                        data,
+                        page - 1,
+                        index=index,
+                        sort_by=None if sort_by == "Default" else sort_by,
+                        ascending=ascending
+                    ))
 
                 # Render map
-                if 'latitude' in filtered_data.columns and 'longitude' in filtered_data.columns:
-                    filtered_data = filtered_data.dropna(subset=['latitude', 'longitude'])
+                if 'latitude' in data.columns and 'longitude' in data.columns:
+                    # Only bins or the tooltip columns of a bounded number of listings are sent to the browser
+                    import pydeck as pdk
+                    grid = get_geo_grid(city, snapshot.version, data)
+                    with timer('buyer_map_data'):
+                        map_mode, map_data = grid.layer_data(matches, map_zoom)
+                    center_latitude, center_longitude = grid.center(matches)
+                    if map_mode == 'points':
+                        tooltip_html = "<b>Listing Name:</b> {name}<br/><b>Price:</b> {price}<br/><b>Review Score:</b> {review_scores_rating}"
+                    else:
+                        tooltip_html = "<b>{name}</b><br/><b>Median Price:</b> {price}<br/><b>Mean Review Score:</b> {review_scores_rating}"
                     deck = pdk.Deck(
                         map_style='mapbox://styles/mapbox/streets-v11',
                         initial_view_state=pdk.ViewState(
-                            latitude=filtered_data['latitude'].mean(),
-                            longitude=filtered_data['longitude'].mean(),
-                            zoom=10,
+                            latitude=center_latitude,
+                            longitude=center_longitude,
+                            zoom=map_zoom,
                             pitch=50,
                         ),
                         layers=[pdk.Layer(
                             'ScatterplotLayer',
-                            data=filtered_data,
+                            data=map_data,
                             get_position='[longitude, latitude]',
                             get_color='[200, 30, 0, 160]',
-                            get_radius=200,
+                            get_radius=200 if map_mode == 'points' else 'radius',
                             pickable=True
                         )],
                         tooltip={
-                            "html": "<b>Listing Name:</b> {name}<br/><b>Price:</b> {price}<br/><b>Review Score:</b> {review_scores_rating}",
+                            "html": tooltip_html,
                             "style": {"backgroundColor": "steelblue", "color": "white"}
                         }
                     )
-                    st.pydeck_chart(deck)
+                    with timer('buyer_map_render'):
+                        st.pydeck_chart(deck)
                 else:
                     st.error("Latitude and longitude columns are missing or invalid.")
             else:
@@ -272,6 +456,13 @@ def main():
     elif navigation == "Seller Page":
         st.header("Seller Page")
 
+        # Load trained model from the registry (or the legacy pickle file)
+        try:
+            scorer = get_scorer(model_registry.current_version())
+        except FileNotFoundError:
+            st.error("Model file not found. Please add the trained model.pickle.")
+            st.stop()
+
         # User inputs for prediction
         st.markdown("<h2 style='font-size: 18px;'>Accommodates</h2>", unsafe_allow_html=True)
         accommodates = st.number_input("", min_value=1, step=1,max_value = 500, label_visibility="collapsed")
@@ -302,7 +493,7 @@ def main():
         # host_neighborhood = st.text_area("Host Neighborhood")
 
         st.markdown("<h2 style='font-size: 18px;'>Amenities</h2>", unsafe_allow_html=True)
-        amenities = st.text_area("", placeholder="Provide available amenities...")
+        amenities = st.text_area("", placeholder="List available amenities, separated by commas (e.g. Wifi, Pool, Free parking)...")
         # amenities = st.text_area("Amenities")
 
         st.markdown("<h2 style='font-size: 18px;'>Property Type</h2>", unsafe_allow_html=True)
@@ -310,10 +501,10 @@ def main():
         # property_type = st.selectbox("Property Type", ["Apartment", "House", "Condo", "unknown"])
 
         # Sentiment Analysis
-        analyzer = SentimentIntensityAnalyzer()
-        neighborhood_sentiment = get_sentiment_score(neighborhood_overview, analyzer)
-        host_neighborhood_sentiment = get_sentiment_score(host_neighborhood, analyzer)
-        amenities_sentiment = get_sentiment_score(amenities, analyzer)
+        neighborhood_sentiment = get_sentiment_score(neighborhood_overview)
+        host_neighborhood_sentiment = get_sentiment_score(host_neighborhood)
+        # Newer models read the amenities themselves as indicator features
+        amenities_sentiment = get_sentiment_score(amenities) if 'amenities_sentiment' in scorer.feature_index else 0
 
         # Prepare input data for prediction
         input_data = pd.DataFrame({
@@ -325,33 +516,16 @@ def main():
             'neighborhood_sentiment': [neighborhood_sentiment],
             'host_neighbourhood_sentiment': [host_neighborhood_sentiment],
             'amenities_sentiment': [amenities_sentiment],
+            'amenities': [amenities],
             'property_type': [property_type]
         })
 
-        # One-hot encode 'property_type'
-        input_data_encoded = encode_property_type(input_data)
-
-        # Ensure the input data has all columns expected by the model
-        for missing_feature in expected_features:
-            if missing_feature not in input_data_encoded.columns:
-                if 'property_type' in missing_feature:
-                    # Add missing property type columns with a default value of 0
-                    input_data_encoded[missing_feature] = 0
-                else:
-                    # Add missing numerical features with a default value of 0
-                    input_data_encoded[missing_feature] = 0
-
-        # Reorder columns to match the expected features
-        input_data_encoded = input_data_encoded[expected_features]
-
          # Add button to submit input data
         if st.button("Predict Review Score"):
-            # Standardize features
+            # One-hot encode 'property_type', align to the expected features and predict in one step
             try:
-                input_data_scaled = scaler.transform(input_data_encoded)
-
-                # Make prediction
-                st.session_state['predicted_score'] = model.predict(input_data_scaled)[0]
+                with timer('seller_predict'):
+                    st.session_state['predicted_score'] = scorer.predict(input_data)[0]
 
                 #Check if Predicted score is greater than 5
                 if st.session_state['predicted_score'] > 5:
@@ -364,6 +538,29 @@ def main():
                 st.error(f"Error during feature scaling or prediction: {e}")
         else:
             st.session_state['predicted_score'] = None
+
+        # What-if: a whole grid of prices (and optionally bedrooms/accommodates) scored in one
+        # batch, reusing the sentiment scores computed above
+        st.markdown("<h2 style='font-size: 18px;'>What-If Price Sweep</h2>", unsafe_allow_html=True)
+        sweep_low, sweep_high = st.slider("Price Range ($)", min_value=10, max_value=2000, value=(10, max(500, int(price))), step=10)
+        sweep_vary = st.multiselect("Also Vary (within 2 of your input)", ["bedrooms", "accommodates"])
+        if st.button("Run Price Sweep"):
+            grid = {'price': range(sweep_low, sweep_high + 1, max(1, (sweep_high - sweep_low) // 100))}
+            for feature in sweep_vary:
+                value = int(input_data[feature].iloc[0])
+                grid[feature] = range(max(1, value - 2), value + 3)
+            with timer('seller_sweep'):
+                curve = scorer.sweep(input_data, **grid)
+
+            if sweep_vary:
+                labels = [curve[f].astype(int).astype(str).radd(f"{f} ") for f in sweep_vary]
+                curve['series'] = labels[0].str.cat(labels[1:], sep=', ')
+                st.line_chart(curve.pivot(index='price', columns='series', values='predicted_review_score'))
+            else:
+                st.line_chart(curve.set_index('price')['predicted_review_score'])
+            best = curve.loc[curve['predicted_review_score'].idxmax()]
+            st.write(f"Highest predicted review score in this range: {best['predicted_review_score']:.2f} at ${best['price']:.0f}"
+                     + "".join(f", {f} {best[f]:.0f}" for f in sweep_vary))
         
              # Footer
     st.markdown("""
@@ -372,5 +569,27 @@ def main():
         </div>
     """, unsafe_allow_html=True)
 
+# Hidden page, opened with ?diagnostics in the URL; needs AIRBNB_METRICS=1 to record stage timings
+def diagnostics():
+    st.header("Diagnostics")
+    if not metrics.ENABLED:
+        st.warning("Stage timings are off, start the app with AIRBNB_METRICS=1 to record them.")
+
+    st.subheader("Stage latency")
+    st.dataframe(pd.DataFrame.from_dict(metrics.stage_stats(), orient='index'))
+
+    st.subheader("Cache hit rates")
+    caches = pd.DataFrame.from_dict(metrics.cache_stats(), orient='index', columns=['hits', 'misses'])
+    caches['hit_rate'] = caches['hits'] / (caches['hits'] + caches['misses']).where(lambda total: total > 0)
+    st.dataframe(caches)
+    info = get_query_cache().info()
+    st.caption(f"Search result cache: {info.currsize} results, {info.nbytes / 2**20:.1f} of {info.max_bytes / 2**20:.0f} MiB")
+
+    st.subheader("Prometheus")
+    st.code(metrics.prometheus_text(), language='text')
+
 if __name__ == "__main__":
-    main()
+    if 'diagnostics' in st.query_params:
+        diagnostics()
+    else:
+        main()
@@ -0,0 +1,102 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+# Model features for amenity indicators are named AMENITY_PREFIX + token
+AMENITY_PREFIX = 'amenity_'
+
+# Amenities listed by fewer listings than this are left out of the vocabulary
+MIN_LISTINGS = 5
+
+_PUNCTUATION = str.maketrans('', '', '[]{}"')
+
+
+def amenity_tokens(amenities):
+    """
+    Split amenity lists into normalized tokens.
+
+    Accepts both the JSON style (`["Wifi", "Hot tub"]`) and the older
+    brace style (`{Wifi,"Hot tub"}`) of the Inside Airbnb exports, as well
+    as plain comma-separated text.
+
+    Returns
+    -------
+    pandas.Series
+        One lower-cased token per row, indexed by the position of the
+        listing it came from; each token appears once per listing.
+    """
+    text = pd.Series(amenities).reset_index(drop=True).astype('string')
+    tokens = text.str.translate(_PUNCTUATION).str.lower().str.split(',').explode().str.strip()
+    tokens = tokens[tokens.notna() & (tokens != '')]
+    # A listing naming an amenity twice counts it once
+    token_codes, uniques = pd.factorize(tokens.to_numpy())
+    pairs = tokens.index.to_numpy(dtype=np.int64) * max(len(uniques), 1) + token_codes
+    return tokens[~pd.Series(pairs).duplicated().to_numpy()]
+
+
+def _distinct_tokens(amenities):
+    """Tokens of each distinct amenity list, plus the distinct list of every row (-1 if missing)."""
+    codes, uniques = pd.factorize(pd.Series(amenities).reset_index(drop=True))
+    return amenity_tokens(pd.Series(uniques, dtype=object)), codes
+
+
+def _vocabulary(tokens, codes, min_listings, max_size):
+    # Listings per distinct list, so each list is only tokenized once
+    repeats = np.bincount(codes[codes >= 0], minlength=len(tokens.index.unique()))
+    counts = pd.Series(repeats[tokens.index.to_numpy()]).groupby(tokens.to_numpy()).sum()
+    counts = counts[counts >= min_listings]
+    # Ties broken by name, so the vocabulary does not depend on row order
+    vocabulary = sorted(counts.index, key=lambda token: (-counts[token], token))
+    return vocabulary[:max_size] if max_size else vocabulary
+
+
+def _matrix(tokens, codes, vocabulary):
+    columns = pd.Index(vocabulary).get_indexer(tokens.to_numpy())
+    known = columns >= 0
+    # One row per distinct list plus an empty one for missing values, then gathered per listing
+    n_distinct = codes.max() + 1 if len(codes) else 0
+    distinct = sparse.csr_matrix(
+        (np.ones(known.sum()), (tokens.index.to_numpy()[known], columns[known])),
+        shape=(n_distinct + 1, len(vocabulary))
+    )
+    return distinct[np.where(codes >= 0, codes, n_distinct)]
+
+
+def build_vocabulary(amenities, min_listings=MIN_LISTINGS, max_size=None):
+    """
+    Amenity tokens common enough to learn from, most frequent first.
+
+    Parameters
+    ----------
+    amenities : pandas.Series
+        Raw amenity lists.
+    min_listings : int, optional
+        Tokens present in fewer listings are dropped.
+    max_size : int, optional
+        Keep at most this many tokens.
+
+    Returns
+    -------
+    list of str
+    """
+    return _vocabulary(*_distinct_tokens(amenities), min_listings, max_size)
+
+
+def amenity_matrix(amenities, vocabulary):
+    """
+    Sparse indicator matrix of the amenities each listing has.
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+        `len(amenities)` x `len(vocabulary)`, 1.0 where the listing lists
+        the amenity. Tokens outside `vocabulary` are ignored.
+    """
+    return _matrix(*_distinct_tokens(amenities), vocabulary)
+
+
+def amenity_features(amenities, min_listings=MIN_LISTINGS, max_size=None):
+    """`build_vocabulary` and `amenity_matrix` in one tokenization pass; returns `(vocabulary, matrix)`."""
+    tokens, codes = _distinct_tokens(amenities)
+    vocabulary = _vocabulary(tokens, codes, min_listings, max_size)
+    return vocabulary, _matrix(tokens, codes, vocabulary)
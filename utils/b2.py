@@ -1,10 +1,35 @@
-import mimetypes 
+import os
+import json
+import hashlib
+import tempfile
+import mimetypes
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import boto3
+from boto3.s3.transfer import TransferConfig
 from botocore.config import Config
+from botocore.exceptions import ClientError
+
+from utils.metrics import cache_hit, timed
+
+# Local content cache for downloaded objects, revalidated by ETag
+CACHE_DIR = os.path.join(
+    os.getenv('AIRBNB_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'airbnb')),
+    'objects'
+)
+
+# Data formats file_to_b2 would otherwise fail to guess a mimetype for
+mimetypes.add_type('application/vnd.apache.parquet', '.parquet')
+mimetypes.add_type('application/octet-stream', '.npz')
+
+# Objects larger than this are fetched in parallel ranged parts
+PART_SIZE = 8 * 1024 * 1024
+MAX_CONCURRENCY = 8
 
 class B2(object):
-    def __init__(self, endpoint, key_id, secret_key):
+    def __init__(self, endpoint, key_id, secret_key, cache_dir=CACHE_DIR,
+                 part_size=PART_SIZE, max_concurrency=MAX_CONCURRENCY):
         """
         Set up a connection between the current instance and Backblaze.
 
@@ -16,16 +41,34 @@ class B2(object):
             The "Key ID" for the application key from Backblaze.
         secret_key : str
             The Key secret, or "Key" for the Backblaze app key itself.
+        cache_dir : str, optional
+            Directory of the local content cache, `None` disables it.
+        part_size : int, optional
+            Size in bytes of each ranged download / multipart upload part.
+        max_concurrency : int, optional
+            Number of parts transferred in parallel.
         """
+        # Accept a full URL so a local S3 stand-in (e.g. moto) can be used
+        if not endpoint.startswith(('http://', 'https://')):
+            endpoint = f"https://{endpoint}"
+
         # Return a boto3 resource object for B2 service
         self.b2 = boto3.resource(
             service_name='s3',
-            endpoint_url=f"https://{endpoint}",
+            endpoint_url=endpoint,
             aws_access_key_id=key_id,
             aws_secret_access_key=secret_key,
-            config=Config(signature_version='s3v4')
+            config=Config(signature_version='s3v4', max_pool_connections=max(10, max_concurrency))
         )
-    
+        self.cache_dir = cache_dir
+        self.part_size = part_size
+        self.max_concurrency = max_concurrency
+        self.transfer_config = TransferConfig(
+            multipart_threshold=part_size,
+            multipart_chunksize=part_size,
+            max_concurrency=max_concurrency
+        )
+
     def set_bucket(self, bucket_name):
         """
         Select a bucket accessible by the chosen app key.
@@ -37,42 +80,173 @@ class B2(object):
         """
         self.bucket = self.b2.Bucket(bucket_name)
 
+    @timed('b2_list_files')
     def list_files(self, verbose=False):
         if verbose:
             return [f.get() for f in self.bucket.objects.all()]
         else:
             return [f.key for f in self.bucket.objects.all()]
 
+    @timed('b2_get_df')
     def get_df(self, remote_path):
-        # Get file
-        obj = self.bucket.Object(remote_path)
-        df = pd.read_csv(obj.get()['Body'])
-        return df
-    
+        # Get file, through the local cache when it is enabled
+        if self.cache_dir is None:
+            return pd.read_csv(self.get_object(remote_path))
+        return pd.read_csv(self.download(remote_path))
+
     def get_object(self, remote_path):
-        obj = self.bucket.Object(remote_path)
-        return obj.get()['Body']
+        return self.get_object_version(remote_path)[0]
+
+    @timed('b2_get_object')
+    def get_object_version(self, remote_path):
+        '''
+        Fetch `remote_path` and the ETag of the version that was read.
+
+        Returns
+        -------
+        tuple
+            `(body, etag)`, a file-like object and the ETag without quotes.
+        '''
+        if self.cache_dir is None:
+            response = self.bucket.Object(remote_path).get()
+            return response['Body'], response['ETag'].strip('"')
+        path, etag = self.download_version(remote_path)
+        with open(path, 'rb') as f:
+            return BytesIO(f.read()), etag.strip('"')
+
+    @timed('b2_head')
+    def head(self, remote_path):
+        """
+        Fetch the metadata of `remote_path` without downloading its body.
+
+        Returns
+        -------
+        dict
+            The HEAD response, including "ETag", "LastModified" and
+            "ContentLength".
+        """
+        client = self.b2.meta.client
+        return client.head_object(Bucket=self.bucket.name, Key=remote_path)
+
+    def exists(self, remote_path):
+        """Check whether `remote_path` is in the bucket with a single HEAD request."""
+        try:
+            self.head(remote_path)
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
 
+    def _cache_paths(self, remote_path):
+        digest = hashlib.sha1(f"{self.bucket.name}/{remote_path}".encode('utf-8')).hexdigest()
+        path = os.path.join(self.cache_dir, digest)
+        return path, f"{path}.json"
+
+    def _cached_etag(self, remote_path):
+        path, meta_path = self._cache_paths(remote_path)
+        if not (os.path.exists(path) and os.path.exists(meta_path)):
+            return None
+        with open(meta_path) as f:
+            return json.load(f)['ETag']
+
+    def download(self, remote_path):
+        '''Make sure the local cache holds the latest `remote_path` and return its path.'''
+        return self.download_version(remote_path)[0]
+
+    @timed('b2_download')
+    def download_version(self, remote_path):
+        '''
+        Make sure the local cache holds the latest `remote_path`, and return
+        its path and the ETag of the cached version.
+
+        The first part is requested with If-None-Match, so an unchanged object
+        costs one empty 304 response. When the object changed and is larger
+        than `part_size`, the remaining parts are fetched in parallel ranged
+        GETs pinned to the new ETag with If-Match.
+        '''
+        client = self.b2.meta.client
+        path, meta_path = self._cache_paths(remote_path)
+        etag = self._cached_etag(remote_path)
+
+        kwargs = {'Bucket': self.bucket.name, 'Key': remote_path, 'Range': f"bytes=0-{self.part_size - 1}"}
+        if etag is not None:
+            kwargs['IfNoneMatch'] = etag
+        try:
+            first = client.get_object(**kwargs)
+        except ClientError as e:
+            code = e.response['Error']['Code']
+            if code in ('304', 'NotModified'):
+                cache_hit('b2_objects')
+                return path, etag
+            if code != 'InvalidRange':
+                raise
+            # Empty objects cannot be requested by range
+            del kwargs['Range']
+            first = client.get_object(**kwargs)
+
+        cache_hit('b2_objects', hit=False)
+        new_etag = first['ETag']
+        content_range = first.get('ContentRange')
+        size = int(content_range.split('/')[-1]) if content_range else first['ContentLength']
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # A file of its own, threads of this process may be downloading the same object
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        with open(fd, 'wb') as f:
+            received = f.write(first['Body'].read())
+            f.truncate(size)
+
+        def fetch_part(start):
+            end = min(start + self.part_size, size) - 1
+            part = client.get_object(
+                Bucket=self.bucket.name, Key=remote_path,
+                Range=f"bytes={start}-{end}", IfMatch=new_etag
+            )
+            with open(tmp_path, 'r+b') as f:
+                f.seek(start)
+                f.write(part['Body'].read())
+
+        starts = range(received, size, self.part_size)
+        try:
+            if starts:
+                with ThreadPoolExecutor(max_workers=self.max_concurrency) as pool:
+                    list(pool.map(fetch_part, starts))
+        except Exception:
+            os.remove(tmp_path)
+            raise
+
+        os.replace(tmp_path, path)
+        fd, tmp_meta_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        with open(fd, 'w') as f:
+            json.dump({'Key': remote_path, 'ETag': new_etag, 'ContentLength': size}, f)
+        os.replace(tmp_meta_path, meta_path)
+        return path, new_etag
+
+    @timed('b2_upload')
     def file_to_b2(self, local_path, remote_path):
         '''
         Send `local_path` file to `remote_path`.
+
+        Files larger than `part_size` are sent as a multipart upload with
+        `max_concurrency` parts in flight.
         '''
         # Guess the type of a file based on its URL
         mimetype, _ = mimetypes.guess_type(local_path)
 
         if mimetype is None:
             raise Exception("Failed to guess mimetype")
-        
-        if remote_path in [f.key for f in self.bucket.objects.all()]:
+
+        if self.exists(remote_path):
             print(f'Overwriting {remote_path} ...')
         else:
             print(f'Uploading {remote_path} ...')
-        
+
         self.bucket.upload_file(
             Filename=local_path,
             Key=remote_path,
             ExtraArgs={
                 "ContentType": mimetype
-            }
+            },
+            Config=self.transfer_config
         )
-
@@ -1,42 +1,100 @@
+import time
+from contextlib import contextmanager
+
+import numpy as np
 import pandas as pd
-def clean_data(df): 
-    
-    def categorize_property_type(property_type):
-        
-        property_type = str(property_type).lower()  # Ensure it's a string and lowercase
-        if property_type.startswith('entire'):
-            return 'Entire Space'
-        elif 'private' in property_type:
-            return 'Private Small Space'
-        elif 'shared' in property_type:
-            return 'Shared Space'
-        else:
-            return 'Other'
-    def categorize_price_range(price):
-        """
-        Categorizes price into specific price ranges.
-        """
-        price = pd.to_numeric(price, errors='coerce')
-        if price < 10:
-            return "Below $10"
-        elif 10 <= price < 500:
-            return "$10 - $500"
-        elif 500 <= price < 1000:
-            return "$500 - $1000"
-        elif 1000 <= price < 5000:
-            return "$1000 - $5000"
-        elif 5000 <= price < 10000:
-            return "$5000 - $10000"
-        elif 10000 <= price < 50000:
-            return "$10000 - $50000"
-        else:
-            return "$50000+"
-    # df['Price'] = pd.to_numeric(df['Price'])
-    df['Price'] = df['Price'].replace({'\$': '', ',': ''}, regex=True)
-    df['price_range'] = df['Price'].apply(categorize_price_range)
-
-
-    # Apply the nested function to the 'property_type' column of the DataFrame
-    df['property_category'] = df['Property Type'].apply(categorize_property_type)
-    
+
+# Lower edges of every price band after the first, and the band labels
+PRICE_EDGES = [10, 500, 1000, 5000, 10000, 50000]
+PRICE_LABELS = [
+    "Below $10", "$10 - $500", "$500 - $1000", "$1000 - $5000",
+    "$5000 - $10000", "$10000 - $50000", "$50000+"
+]
+
+PROPERTY_CATEGORIES = ['Entire Space', 'Private Small Space', 'Shared Space', 'Other']
+
+
+@contextmanager
+def _stage(timings, name):
+    start = time.perf_counter()
+    yield
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
+
+
+def categorize_price_range(price):
+    """
+    Categorizes prices into specific price ranges.
+
+    Missing or unparseable prices fall in "$50000+", as they always have.
+    """
+    values = pd.to_numeric(price, errors='coerce')
+    values = np.asarray(values, dtype=float)
+    # NaN sorts past every edge, into the last band
+    codes = np.searchsorted(PRICE_EDGES, values, side='right')
+    return pd.Categorical.from_codes(codes, categories=PRICE_LABELS)
+
+
+def categorize_property_type(property_type):
+    """Categorizes property types, working on the distinct values only."""
+    codes, uniques = pd.factorize(property_type)
+    lowered = pd.Index(uniques).astype(str).str.lower()
+    categories = np.select(
+        [lowered.str.startswith('entire'), lowered.str.contains('private'), lowered.str.contains('shared')],
+        [0, 1, 2],
+        default=3
+    )
+    # Missing values (code -1) are 'Other', like str(nan) was
+    categories = np.append(categories, 3)
+    return pd.Categorical.from_codes(categories[codes], categories=PROPERTY_CATEGORIES)
+
+
+def _clean(df, timings):
+    with _stage(timings, 'strip_price'):
+        if not pd.api.types.is_numeric_dtype(df['Price']):
+            # Through the string dtype numbers and missing values strip too, so a
+            # chunk of an object column holding no strings works as well
+            price = df['Price'].astype('string').str.replace(r'[$,]', '', regex=True)
+            df['Price'] = pd.to_numeric(price, errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+
+    with _stage(timings, 'price_range'):
+        df['price_range'] = categorize_price_range(df['Price'])
+
+    # Apply the categorization to the 'property_type' column of the DataFrame
+    with _stage(timings, 'property_category'):
+        df['property_category'] = categorize_property_type(df['Property Type'])
     return df
+
+
+def clean_data(df, chunksize=None, timings=None):
+    """
+    Adds the `price_range` and `property_category` columns.
+
+    'Price' is parsed into float numbers, with '$' and ',' stripped and
+    unparseable values NaN, rather than left as stripped strings.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame or iterable of pandas.DataFrame
+        Listings with 'Price' and 'Property Type' columns, or chunks of them.
+    chunksize : int, optional
+        Clean `df` this many rows at a time.
+    timings : dict, optional
+        Filled with the seconds spent in each stage, summed over chunks.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The cleaned listings, all chunks concatenated.
+    """
+    if isinstance(df, pd.DataFrame) and chunksize is None:
+        return _clean(df, timings)
+
+    if isinstance(df, pd.DataFrame):
+        chunks = (df.iloc[i:i + chunksize].copy() for i in range(0, len(df), chunksize))
+    else:
+        chunks = df
+    cleaned = [_clean(chunk, timings) for chunk in chunks]
+    with _stage(timings, 'concat'):
+        # Every chunk has the same fixed categories, so the dtype is kept
+        return pd.concat(cleaned)
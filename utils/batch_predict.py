@@ -0,0 +1,177 @@
+import os
+import sys
+import argparse
+
+# Add the parent directory to Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import numpy as np
+import pandas as pd
+
+from utils.sentiment import SENTIMENT_SOURCES, add_sentiment_features
+from utils.amenities import AMENITY_PREFIX, amenity_matrix
+
+PROPERTY_TYPE_PREFIX = 'property_type_'
+
+
+class BatchScorer(object):
+    def __init__(self, model, scaler, expected_features):
+        """
+        Vectorized review score predictions from a trained model.
+
+        The StandardScaler is folded into the regression coefficients, so
+        scoring a batch is one matrix-vector product over the unscaled
+        features. Property types are one-hot encoded straight into their
+        column of `expected_features` through a precomputed mapping, and
+        amenity indicator features are scored from a sparse matrix of the
+        raw `amenities` text.
+
+        Parameters
+        ----------
+        model : sklearn.linear_model.LinearRegression
+            Fitted on the scaled features.
+        scaler : sklearn.preprocessing.StandardScaler
+            Fitted scaler for `expected_features`.
+        expected_features : list of str
+            Feature order the model was trained with.
+        """
+        coef = np.asarray(model.coef_, dtype=float).ravel()
+        mean = getattr(scaler, 'mean_', None)
+        scale = getattr(scaler, 'scale_', None)
+        mean = np.zeros_like(coef) if mean is None else np.asarray(mean, dtype=float)
+        scale = np.ones_like(coef) if scale is None else np.asarray(scale, dtype=float)
+
+        # model(scaler(x)) = coef . (x - mean) / scale + b = weights . x + intercept
+        self.weights = coef / scale
+        self.intercept = float(np.ravel(model.intercept_)[0]) - self.weights @ mean
+
+        # Amenity indicators are kept apart from the dense features
+        amenity = np.array([f.startswith(AMENITY_PREFIX) for f in expected_features], dtype=bool)
+        self.amenity_vocabulary = [f[len(AMENITY_PREFIX):] for f in np.asarray(expected_features)[amenity]]
+        self.amenity_weights = self.weights[amenity]
+        self.dense_weights = self.weights[~amenity]
+
+        self.features = [f for f in expected_features if not f.startswith(AMENITY_PREFIX)]
+        self.feature_index = {feature: i for i, feature in enumerate(self.features)}
+        self.property_type_index = {
+            feature[len(PROPERTY_TYPE_PREFIX):]: i
+            for i, feature in enumerate(self.features)
+            if feature.startswith(PROPERTY_TYPE_PREFIX)
+        }
+
+    def transform(self, df):
+        """
+        Align `df` to the dense `expected_features` as an unscaled float matrix.
+
+        Features missing from `df` are left at 0, as are property types the
+        model was not trained on.
+        """
+        X = np.zeros((len(df), len(self.features)))
+        for col in df.columns.intersection(self.features):
+            X[:, self.feature_index[col]] = pd.to_numeric(df[col], errors='coerce').to_numpy(dtype=float)
+
+        if 'property_type' in df.columns and self.property_type_index:
+            codes, uniques = pd.factorize(df['property_type'])
+            positions = np.array([self.property_type_index.get(str(u), -1) for u in uniques] + [-1])
+            rows = positions[codes]  # code -1 (missing) picks the trailing -1
+            known = rows >= 0
+            X[np.flatnonzero(known), rows[known]] = 1
+        return X
+
+    def _amenity_scores(self, df):
+        if self.amenity_vocabulary and 'amenities' in df.columns:
+            return amenity_matrix(df['amenities'], self.amenity_vocabulary) @ self.amenity_weights
+        return np.zeros(len(df))
+
+    def predict(self, df):
+        """Predicted review scores for every row of `df`."""
+        return self.transform(df) @ self.dense_weights + self.intercept + self._amenity_scores(df)
+
+    def sweep(self, listing, **grid):
+        """
+        What-if scores of one listing over a grid of feature values.
+
+        The listing is featurized once, its sentiment and amenity features
+        included, then repeated over every combination of the `grid`
+        values and scored with a single matrix-vector product.
+
+        Parameters
+        ----------
+        listing : pandas.DataFrame
+            The listing, as its first row, with the columns `predict` takes.
+        **grid : array-like
+            Values to try for dense features, e.g. `price=range(50, 500, 10)`.
+            Features the model does not use leave the scores unchanged.
+
+        Returns
+        -------
+        pandas.DataFrame
+            One row per combination, with a column per grid feature and
+            `predicted_review_score`.
+        """
+        listing = listing.iloc[:1]
+        combos = pd.MultiIndex.from_product(
+            [np.asarray(values, dtype=float) for values in grid.values()], names=list(grid)
+        ).to_frame(index=False)
+
+        X = np.repeat(self.transform(listing), len(combos), axis=0)
+        for feature in grid:
+            if feature in self.feature_index:
+                X[:, self.feature_index[feature]] = combos[feature].to_numpy()
+        scores = X @ self.dense_weights + self.intercept + self._amenity_scores(listing)[0]
+        return combos.assign(predicted_review_score=scores)
+
+    def sentiment_sources(self):
+        """The SENTIMENT_SOURCES features this model uses."""
+        return {f: src for f, src in SENTIMENT_SOURCES.items() if f in self.feature_index}
+
+
+def read_listings(path):
+    """Read candidate listings from a CSV or Parquet file."""
+    if path.lower().endswith('.parquet'):
+        return pd.read_parquet(path)
+    return pd.read_csv(path)
+
+
+def score_listings(listings, scorer=None):
+    """
+    Predict review scores for a batch of candidate listings.
+
+    Parameters
+    ----------
+    listings : pandas.DataFrame or str
+        The listings, or a path to a CSV/Parquet file of them. Raw text
+        columns are scored for sentiment when the sentiment features are
+        not already present.
+    scorer : BatchScorer, optional
+        Defaults to one built from `load_model()`.
+
+    Returns
+    -------
+    pandas.DataFrame
+        `listings` with a `predicted_review_score` column added.
+    """
+    if scorer is None:
+        from utils.modeling_sentiment import load_model
+        scorer = BatchScorer(*load_model())
+    if isinstance(listings, str):
+        listings = read_listings(listings)
+
+    # Only score the sentiment features the listings do not already have
+    missing = {f: src for f, src in scorer.sentiment_sources().items() if f not in listings.columns}
+    listings = add_sentiment_features(listings, sources=missing)
+    return listings.assign(predicted_review_score=scorer.predict(listings))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Predict review scores for a file of listings.")
+    parser.add_argument('input', help="CSV or Parquet file of candidate listings")
+    parser.add_argument('output', help="CSV or Parquet file to write the scored listings to")
+    args = parser.parse_args()
+
+    scored = score_listings(args.input)
+    if args.output.lower().endswith('.parquet'):
+        scored.to_parquet(args.output, index=False)
+    else:
+        scored.to_csv(args.output, index=False)
+    print(f"Scored {len(scored)} listings, saved to {args.output}")
@@ -0,0 +1,397 @@
+import os
+import sys
+import ast
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+from itertools import combinations
+from datetime import datetime, timezone
+
+# Add the parent directory to Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import numpy as np
+import pandas as pd
+from sklearn.linear_model import LinearRegression
+from sklearn.preprocessing import StandardScaler
+
+from utils.amenities import amenity_features
+from utils.basic_clean import clean_data
+from utils.batch_predict import BatchScorer
+from utils.modeling_sentiment import encode_property_type
+from utils.search import ListingIndex
+from utils.sentiment import SENTIMENT_SOURCES, get_analyzer, score_texts
+from utils.snapshot import load_local_snapshot, read_source
+
+SUITES = ['startup', 'load', 'filters', 'sentiment', 'predict', 'clean']
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# Imported by the pages themselves on first use, not by an import statement in app.py
+PAGE_IMPORTS = ['import vaderSentiment.vaderSentiment']
+
+# Packages reported as loaded (or not) after each startup case
+HEAVY_MODULES = ['boto3', 'sklearn', 'scipy', 'pydeck', 'vaderSentiment', 'pyarrow']
+
+DEFAULT_ROWS = [10_000, 100_000]
+
+# Excel is too slow (and capped at ~1M rows) to write at every scale
+EXCEL_MAX_ROWS = 100_000
+
+# Austin-like listing mix
+PROPERTY_TYPES = {
+    'Entire home': 0.38, 'Entire rental unit': 0.22, 'Private room in home': 0.12,
+    'Entire condo': 0.07, 'Entire guesthouse': 0.04, 'Private room in rental unit': 0.04,
+    'Entire townhouse': 0.04, 'Entire guest suite': 0.03, 'Shared room in home': 0.01,
+    'Room in hotel': 0.02, 'Tiny home': 0.02, 'Camper/RV': 0.01,
+}
+NEIGHBOURHOODS = [
+    'Downtown', 'East Austin', 'South Congress', 'Zilker', 'Hyde Park', 'Travis Heights',
+    'Bouldin Creek', 'Clarksville', 'Mueller', 'North Loop', 'Rainey Street', 'Barton Hills',
+]
+PHRASES = [
+    'walkable to restaurants and bars', 'quiet tree-lined street', 'close to the lake',
+    'lively nightlife', 'great food trucks nearby', 'a bit noisy on weekends', 'safe and friendly',
+    'easy access to downtown', 'beautiful parks and trails', 'limited parking',
+]
+AMENITIES = [
+    'Wifi', 'Kitchen', 'Air conditioning', 'Free parking', 'Pool', 'Hot tub', 'Washer', 'Dryer',
+    'TV', 'Workspace', 'Coffee maker', 'Patio', 'BBQ grill', 'Pets allowed', 'Self check-in',
+]
+
+# Distinct texts per column; real listings repeat a lot of boilerplate too
+TEXT_POOL = 5000
+
+
+def _texts(rng, n, build):
+    pool = np.array([build(rng) for _ in range(TEXT_POOL)], dtype=object)
+    return pool[rng.integers(0, TEXT_POOL, n)]
+
+
+def _overview(rng):
+    picks = rng.choice(PHRASES, rng.integers(1, 4), replace=False)
+    return f"{rng.choice(NEIGHBOURHOODS)} is {', '.join(picks)}."
+
+
+def _amenities(rng):
+    return json.dumps(sorted(rng.choice(AMENITIES, rng.integers(3, 12), replace=False).tolist()))
+
+
+def generate_listings(n, seed=0):
+    """
+    Synthetic Austin-like listings with every column the app and training read.
+
+    Returns
+    -------
+    pandas.DataFrame
+        `n` listings, including the Excel-style 'Price' and 'Property Type'
+        columns `clean_data` expects.
+    """
+    rng = np.random.default_rng(seed)
+    types = list(PROPERTY_TYPES)
+    weights = np.array(list(PROPERTY_TYPES.values()))
+    property_type = np.array(types, dtype=object)[rng.choice(len(types), n, p=weights / weights.sum())]
+    bedrooms = np.clip(rng.poisson(1.6, n) + 1, 1, 10)
+    price = np.round(np.exp(rng.normal(5.0, 0.7, n)) * (0.6 + 0.25 * bedrooms), 2)
+    rating = np.round(np.clip(5 - rng.gamma(1.2, 0.18, n), 0, 5), 2)
+    rating[rng.random(n) < 0.05] = np.nan
+
+    data = pd.DataFrame({
+        'id': (10**6 + rng.permutation(n)).astype(np.int64),
+        'name': _texts(rng, n, lambda r: f"{r.choice(['Cozy', 'Modern', 'Charming', 'Spacious'])} "
+                                         f"{r.choice(['bungalow', 'loft', 'studio', 'retreat'])} in "
+                                         f"{r.choice(NEIGHBOURHOODS)}"),
+        'price': price,
+        'review_scores_rating': rating,
+        'property_type': property_type,
+        'bedrooms': bedrooms,
+        'beds': bedrooms + rng.integers(0, 2, n),
+        'bathrooms': np.maximum(1, np.round(bedrooms * rng.uniform(0.5, 1.0, n) * 2) / 2),
+        'accommodates': bedrooms * 2 + rng.integers(0, 2, n),
+        'latitude': 30.27 + rng.normal(0, 0.06, n),
+        'longitude': -97.74 + rng.normal(0, 0.07, n),
+        'neighborhood_overview': _texts(rng, n, _overview),
+        'host_neighbourhood': _texts(rng, n, lambda r: r.choice(NEIGHBOURHOODS)),
+        'amenities': _texts(rng, n, _amenities),
+    })
+    data['listing_url'] = 'https://www.airbnb.com/rooms/' + data['id'].astype(str)
+    data['Price'] = '$' + pd.Series(price).map('{:,.2f}'.format)
+    data['Property Type'] = data['property_type']
+    return data
+
+
+def app_imports(path=os.path.join(ROOT, 'app.py')):
+    """
+    Import statements of the app.
+
+    Returns
+    -------
+    tuple
+        `(startup, every_page)`: the module-level import statements, run on
+        every cold start, and those plus the ones inside functions.
+    """
+    with open(path) as f:
+        tree = ast.parse(f.read())
+
+    def statements(nodes):
+        return [ast.unparse(n) for n in nodes if isinstance(n, (ast.Import, ast.ImportFrom))]
+    startup = statements(tree.body)
+    every_page = list(dict.fromkeys(startup + statements(ast.walk(tree)) + PAGE_IMPORTS))
+    return startup, every_page
+
+
+def _import_seconds(statements):
+    """Time `statements` in a fresh interpreter; returns seconds and the heavy packages loaded."""
+    code = '\n'.join(
+        ['import sys, time', 't = time.perf_counter()'] + statements +
+        ['print(time.perf_counter() - t)', f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"]
+    )
+    out = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True)
+    seconds, loaded = out.stdout.strip().splitlines()[-2:]
+    return float(seconds), [m for m in loaded.split(',') if m]
+
+
+def _time(fn, repeat=3):
+    """Run `fn` `repeat` times, returning timing stats and the last result."""
+    runs = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        runs.append(time.perf_counter() - start)
+    return {'min': min(runs), 'median': float(np.median(runs)), 'mean': float(np.mean(runs))}, result
+
+
+class Benchmark(object):
+    def __init__(self, repeat=3, workdir=None):
+        """
+        Runs the benchmark suites and collects their results.
+
+        Parameters
+        ----------
+        repeat : int, optional
+            Timed runs per case; the min, median and mean are reported.
+        workdir : str, optional
+            Scratch directory for generated files, a temporary one by default.
+        """
+        self.repeat = repeat
+        self.workdir = workdir or tempfile.mkdtemp(prefix='airbnb-bench-')
+        self.results = []
+
+    def record(self, suite, case, rows, fn, repeat=None, **extra):
+        seconds, result = _time(fn, repeat or self.repeat)
+        entry = {'suite': suite, 'case': case, 'rows': rows, 'seconds': seconds}
+        if extra.get('items'):
+            entry['items_per_second'] = extra.pop('items') / seconds['median']
+        entry.update(extra)
+        self.results.append(entry)
+        print(f"{suite:10s} {case:52s} rows={rows:<10d} median={seconds['median'] * 1000:10.2f} ms")
+        return result
+
+    def startup(self):
+        """Cold import time of the app's first page vs. every page, each in a new interpreter."""
+        startup, every_page = app_imports()
+        for case, statements in (('app startup imports', startup), ('app imports, every page', every_page)):
+            runs = []
+            for _ in range(self.repeat):
+                seconds, loaded = _import_seconds(statements)
+                runs.append(seconds)
+            entry = {
+                'suite': 'startup', 'case': case, 'rows': 0,
+                'seconds': {'min': min(runs), 'median': float(np.median(runs)), 'mean': float(np.mean(runs))},
+                'loaded': loaded,
+            }
+            self.results.append(entry)
+            print(f"{'startup':10s} {case:52s} median={entry['seconds']['median'] * 1000:10.2f} ms  loaded={','.join(loaded)}")
+
+    def load(self, data):
+        n = len(data)
+        columns = [c for c in data.columns if c not in ('Price', 'Property Type')]
+        base = os.path.join(self.workdir, f"listings-{n}")
+
+        data[columns].to_parquet(base + '.parquet', index=False)
+        data[columns].to_csv(base + '.csv', index=False)
+        sources = ['.parquet', '.csv']
+        if n <= EXCEL_MAX_ROWS:
+            data[columns].to_excel(base + '.xlsx', index=False)
+            sources.append('.xlsx')
+
+        for ext in sources:
+            path = base + ext
+            with open(path, 'rb') as f:
+                content = f.read()
+            self.record('load', f"parse {ext}", n, lambda: read_source(content, path),
+                        repeat=1 if ext == '.xlsx' else None, bytes=len(content))
+
+            cache_dir = os.path.join(self.workdir, 'snapshots')
+
+            def cold():
+                shutil.rmtree(cache_dir, ignore_errors=True)
+                return load_local_snapshot(path, cache_dir=cache_dir)
+            self.record('load', f"snapshot {ext} (convert)", n, cold, repeat=1)
+            self.record('load', f"snapshot {ext} (memory-mapped)", n,
+                        lambda: load_local_snapshot(path, cache_dir=cache_dir))
+
+    def filters(self, data):
+        n = len(data)
+        index = self.record('filters', 'build ListingIndex', n, lambda: ListingIndex(data), repeat=1)
+        criteria = {
+            'min_rating': 4.5,
+            'max_price': 200,
+            'property_type': 'Entire home',
+            'bedrooms': 2,
+        }
+        masks = {
+            'min_rating': lambda: data['review_scores_rating'] >= 4.5,
+            'max_price': lambda: data['price'] <= 200,
+            'property_type': lambda: data['property_type'] == 'Entire home',
+            'bedrooms': lambda: data['bedrooms'] == 2,
+        }
+        for k in range(1, len(criteria) + 1):
+            for combo in combinations(criteria, k):
+                name = '+'.join(combo)
+
+                def pandas_filter():
+                    mask = masks[combo[0]]()
+                    for col in combo[1:]:
+                        mask &= masks[col]()
+                    return data[mask]
+                expected = self.record('filters', f"pandas {name}", n, pandas_filter)
+                found = self.record('filters', f"index {name}", n,
+                                    lambda: index.search(**{c: criteria[c] for c in combo}),
+                                    matches=len(expected))
+                if len(found) != len(expected):
+                    raise RuntimeError(f"{name}: index returned {len(found)} rows, pandas {len(expected)}")
+
+    def sentiment(self, data, sample):
+        texts = data['neighborhood_overview'].iloc[:sample].tolist()
+        analyzer = get_analyzer()
+        self.record('sentiment', 'VADER per text', len(texts),
+                    lambda: [analyzer.polarity_scores(t)['compound'] for t in texts], repeat=1, items=len(texts))
+        self.record('sentiment', 'score_texts (deduplicated, pool)', len(texts),
+                    lambda: score_texts(texts, cache_path=None), repeat=1, items=len(texts),
+                    distinct=len(set(texts)))
+        cache_path = os.path.join(self.workdir, 'sentiment_cache.pickle')
+        score_texts(texts, cache_path=cache_path)
+        self.record('sentiment', 'score_texts (disk cache hit)', len(texts),
+                    lambda: score_texts(texts, cache_path=cache_path), items=len(texts))
+
+        # The model featurizes amenities as sparse indicators instead of VADER scores
+        amenities = data['amenities'].iloc[:sample].tolist()
+        self.record('sentiment', 'VADER amenities per text', len(amenities),
+                    lambda: [analyzer.polarity_scores(t)['compound'] for t in amenities], repeat=1,
+                    items=len(amenities))
+        vocabulary, matrix = self.record('sentiment', 'amenity_features (vocabulary + CSR)', len(data),
+                                         lambda: amenity_features(data['amenities']), items=len(data))
+        self.results[-1].update(vocabulary=len(vocabulary), nnz=int(matrix.nnz))
+
+    def predict(self, data, single_rows=1000):
+        n = len(data)
+        # Random sentiment stands in for VADER here, it does not change the cost of predicting
+        rng = np.random.default_rng(0)
+        features = data.assign(**{f: rng.uniform(-1, 1, n) for f in SENTIMENT_SOURCES})
+        feature_columns = [
+            'accommodates', 'bathrooms', 'bedrooms', 'beds', 'price',
+            'neighborhood_sentiment', 'host_neighbourhood_sentiment',
+            'amenities_sentiment', 'property_type'
+        ]
+        X = encode_property_type(features[feature_columns])
+        y = features['review_scores_rating'].fillna(4.7)
+        scaler = StandardScaler()
+        model = LinearRegression()
+        self.record('predict', 'fit LinearRegression', n, lambda: model.fit(scaler.fit_transform(X), y), repeat=1)
+        scorer = BatchScorer(model, scaler, list(X.columns))
+
+        rows = features[feature_columns].iloc[:single_rows]
+        singles = [rows.iloc[[i]] for i in range(len(rows))]
+
+        def legacy_single():
+            # The Seller Page path before BatchScorer: dummies, reindex, scale, predict
+            for row in singles:
+                aligned = encode_property_type(row).reindex(columns=X.columns, fill_value=0)
+                model.predict(scaler.transform(aligned))
+        self.record('predict', 'legacy single-row', len(singles), legacy_single, repeat=1, items=len(singles))
+        self.record('predict', 'BatchScorer single-row', len(singles),
+                    lambda: [scorer.predict(row) for row in singles], repeat=1, items=len(singles))
+        self.record('predict', 'BatchScorer batch', n, lambda: scorer.predict(features), items=n)
+
+    def clean(self, data):
+        n = len(data)
+        raw = data[['Price', 'Property Type']]
+        self.record('clean', 'clean_data', n, lambda: clean_data(raw.copy()))
+        self.record('clean', 'clean_data (chunks of 100k)', n, lambda: clean_data(raw.copy(), chunksize=100_000))
+
+    def run(self, rows, suites=SUITES, seed=0, sentiment_rows=2000):
+        if 'startup' in suites:
+            self.startup()
+        suites = [suite for suite in suites if suite != 'startup']
+        for n in rows if suites else []:
+            start = time.perf_counter()
+            data = generate_listings(n, seed)
+            print(f"Generated {n} listings in {time.perf_counter() - start:.1f}s")
+            for suite in suites:
+                if suite == 'sentiment':
+                    self.sentiment(data, min(n, sentiment_rows))
+                else:
+                    getattr(self, suite)(data)
+        return self.report(rows, seed)
+
+    def report(self, rows, seed):
+        return {
+            'created': datetime.now(timezone.utc).isoformat(),
+            'rows': rows,
+            'seed': seed,
+            'repeat': self.repeat,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'versions': {'numpy': np.__version__, 'pandas': pd.__version__},
+            'results': self.results,
+        }
+
+
+def compare(report, baseline, threshold=1.2):
+    """Print the median time ratio of each case against a previous report."""
+    previous = {(r['suite'], r['case'], r['rows']): r for r in baseline['results']}
+    slower = 0
+    for r in report['results']:
+        old = previous.get((r['suite'], r['case'], r['rows']))
+        if old is None:
+            continue
+        ratio = r['seconds']['median'] / max(old['seconds']['median'], 1e-9)
+        flag = 'SLOWER' if ratio > threshold else ''
+        slower += bool(flag)
+        print(f"{r['suite']:10s} {r['case']:45s} rows={r['rows']:<10d} x{ratio:6.2f} {flag}")
+    return slower
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark loading, search, sentiment, prediction and cleaning on synthetic listings.")
+    parser.add_argument('--rows', type=int, nargs='+', default=DEFAULT_ROWS,
+                        help="Listing counts to generate, e.g. 10000 1000000 10000000")
+    parser.add_argument('--suites', nargs='+', choices=SUITES, default=SUITES)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--sentiment-rows', type=int, default=2000,
+                        help="Texts scored by the sentiment suite (VADER is slow)")
+    parser.add_argument('--output', default='benchmark.json', help="Where to write the JSON report")
+    parser.add_argument('--compare', help="Previous JSON report to compare against")
+    args = parser.parse_args()
+
+    bench = Benchmark(repeat=args.repeat)
+    try:
+        report = bench.run(args.rows, args.suites, args.seed, args.sentiment_rows)
+    finally:
+        shutil.rmtree(bench.workdir, ignore_errors=True)
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Saved {len(report['results'])} results to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        sys.exit(1 if compare(report, baseline) else 0)
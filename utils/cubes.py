@@ -0,0 +1,404 @@
+import os
+import sys
+import glob
+import json
+import shutil
+import hashlib
+import argparse
+
+# Add the parent directory to Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import numpy as np
+import pandas as pd
+
+from utils.amenities import amenity_tokens
+from utils.basic_clean import PRICE_LABELS, clean_data
+from utils.ingest import CHUNK_ROWS, STREAMING_EXTENSIONS, iter_source_chunks
+from utils.snapshot import CACHE_DIR, read_source, snapshot_version
+
+CUBE_DIR = os.path.join(CACHE_DIR, 'cubes')
+
+# Additive measures, so cubes can be updated with new (or removed) listings
+MEASURES = ['count', 'rating_count', 'rating_sum', 'rating_sq_sum', 'price_count', 'price_sum']
+
+NEIGHBOURHOOD_DIMS = ['neighbourhood', 'property_category', 'price_range']
+AMENITY_DIMS = ['amenity']
+
+# First column found is used, app snapshots and raw exports name them differently
+SOURCE_COLUMNS = {
+    'neighbourhood': ['neighbourhood_cleansed', 'neighbourhood', 'host_neighbourhood'],
+    'price': ['price', 'Price'],
+    'property_type': ['property_type', 'Property Type'],
+    'rating': ['review_scores_rating'],
+    'amenities': ['amenities'],
+}
+
+CUBE_FILES = {'neighbourhood': 'neighbourhood.parquet', 'amenity': 'amenity.parquet'}
+META_FILE = 'meta.json'
+# Cube inputs of every listing by id, so the next version can be derived from this one
+ROWS_FILE = 'listings.parquet'
+
+
+def _column(df, name):
+    for col in SOURCE_COLUMNS[name]:
+        if col in df.columns:
+            return df[col]
+    return None
+
+
+def tracked_rows(listings):
+    """
+    The columns the cubes read of `listings`, indexed by id, with a hash per
+    row to tell changed listings apart. The last row of a repeated id wins.
+    """
+    columns = []
+    for names in SOURCE_COLUMNS.values():
+        found = [c for c in names if c in listings.columns]
+        if found:
+            columns.append(found[0])
+    rows = listings[['id'] + columns].drop_duplicates('id', keep='last').set_index('id')
+    rows = rows.astype({c: object for c in columns if isinstance(rows[c].dtype, pd.CategoricalDtype)})
+    return rows.assign(row_hash=pd.util.hash_pandas_object(rows, index=False).to_numpy())
+
+
+def _measures(rating, price):
+    rating = pd.to_numeric(rating, errors='coerce').to_numpy(dtype=float)
+    price = pd.to_numeric(price, errors='coerce').to_numpy(dtype=float)
+    rated = ~np.isnan(rating)
+    priced = ~np.isnan(price)
+    return pd.DataFrame({
+        'count': np.ones(len(rating), dtype=np.int64),
+        'rating_count': rated.astype(np.int64),
+        'rating_sum': np.where(rated, rating, 0),
+        'rating_sq_sum': np.where(rated, rating, 0) ** 2,
+        'price_count': priced.astype(np.int64),
+        'price_sum': np.where(priced, price, 0),
+    })
+
+
+class Cube(object):
+    def __init__(self, dims, table=None):
+        """
+        Group-by cube of additive listing measures.
+
+        Parameters
+        ----------
+        dims : list of str
+            Dimension names, the levels of the table index.
+        table : pandas.DataFrame, optional
+            Existing `MEASURES` indexed by `dims`.
+        """
+        self.dims = list(dims)
+        if table is None:
+            index = pd.MultiIndex.from_arrays([[]] * len(self.dims), names=self.dims)
+            table = pd.DataFrame({m: pd.Series(dtype=float) for m in MEASURES}, index=index)
+        self.table = table
+
+    def update(self, keys, measures, sign=1):
+        """Add (or with `sign=-1` remove) listings, given their dimension `keys` and `measures`."""
+        grouped = measures.groupby([keys[d].to_numpy() for d in self.dims]).sum()
+        grouped.index.names = self.dims
+        table = self.table.add(grouped * sign, fill_value=0)
+        self.table = table[table['count'] > 0]
+
+    def stats(self, table=None):
+        """Measures turned into listing counts, rating mean/std and mean price."""
+        t = self.table if table is None else table
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean_rating = t['rating_sum'] / t['rating_count']
+            # Sample variance, like pandas' std()
+            variance = (t['rating_sq_sum'] - t['rating_count'] * mean_rating ** 2) / (t['rating_count'] - 1)
+            return pd.DataFrame({
+                'listings': t['count'].astype(np.int64),
+                'mean_rating': mean_rating,
+                'std_rating': np.sqrt(variance.clip(lower=0)),
+                'mean_price': t['price_sum'] / t['price_count'],
+            }, index=t.index)
+
+    def rollup(self, by, **where):
+        """
+        Stats grouped by the `by` dimensions, over the cells matching `where`.
+
+        e.g. `rollup(['neighbourhood'], property_category='Entire Space')`.
+        """
+        t = self.table
+        for dim, value in where.items():
+            if value is not None:
+                t = t[t.index.get_level_values(dim) == value]
+        return self.stats(t.groupby(level=by).sum() if by else t.sum().to_frame().T)
+
+
+class AnalyticsCubes(object):
+    def __init__(self, version=None, neighbourhood=None, amenity=None, rows=0):
+        """
+        Neighbourhood and amenity insight cubes of one listing snapshot.
+
+        The neighbourhood cube is keyed by neighbourhood x property_category
+        x price_range (as derived by `clean_data`), the amenity cube by
+        amenity token. Both only hold sums, so new listings are folded in
+        with `update` without rereading the rest.
+
+        Parameters
+        ----------
+        version : str, optional
+            Version of the snapshot the cubes were built from.
+        neighbourhood, amenity : Cube, optional
+            Existing cubes, empty ones by default.
+        rows : int, optional
+            Listings aggregated so far.
+        """
+        self.version = version
+        self.neighbourhood = neighbourhood or Cube(NEIGHBOURHOOD_DIMS)
+        self.amenity = amenity or Cube(AMENITY_DIMS)
+        self.rows = rows
+
+    def update(self, listings, sign=1):
+        """Fold a batch of listings into both cubes (`sign=-1` takes them out)."""
+        price = _column(listings, 'price')
+        property_type = _column(listings, 'property_type')
+        if price is None or property_type is None:
+            raise ValueError("Listings need price and property type columns")
+        cleaned = clean_data(pd.DataFrame({
+            'Price': price.to_numpy(),
+            'Property Type': property_type.astype(object).to_numpy(),
+        }))
+        neighbourhood = _column(listings, 'neighbourhood')
+        keys = pd.DataFrame({
+            'neighbourhood': 'Unknown' if neighbourhood is None else neighbourhood.astype(object).fillna('Unknown').to_numpy(),
+            'property_category': cleaned['property_category'].astype(str).to_numpy(),
+            'price_range': cleaned['price_range'].astype(str).to_numpy(),
+        })
+        rating = _column(listings, 'rating')
+        measures = _measures(rating if rating is not None else np.full(len(listings), np.nan), cleaned['Price'])
+        self.neighbourhood.update(keys, measures, sign)
+
+        amenities = _column(listings, 'amenities')
+        if amenities is not None:
+            tokens = amenity_tokens(amenities)
+            rows = tokens.index.to_numpy()
+            self.amenity.update(
+                pd.DataFrame({'amenity': tokens.to_numpy()}),
+                measures.iloc[rows].reset_index(drop=True),
+                sign
+            )
+        self.rows += sign * len(listings)
+        return self
+
+    @classmethod
+    def build(cls, chunks, version=None):
+        """Aggregate an iterable of listing DataFrames (one is fine) into new cubes."""
+        cubes = cls(version)
+        for chunk in chunks:
+            if len(chunk):
+                cubes.update(chunk)
+        return cubes
+
+    def derive(self, previous_rows, rows, version):
+        """
+        Cubes of a new version, from these ones and the listings that differ.
+
+        Listings are compared by id against `previous_rows`, the
+        `tracked_rows` these cubes were built from: removed and changed ones
+        are taken out and new and changed ones folded in, so only those are
+        cleaned and aggregated again. These cubes are left unchanged.
+
+        Returns
+        -------
+        (AnalyticsCubes, dict)
+            The new cubes, and the number of added, changed and removed listings.
+        """
+        common = rows.index.intersection(previous_rows.index)
+        changed = common[rows['row_hash'].loc[common].to_numpy()
+                         != previous_rows['row_hash'].loc[common].to_numpy().astype('uint64')]
+        added = rows.index.difference(previous_rows.index)
+        removed = previous_rows.index.difference(rows.index)
+
+        cubes = AnalyticsCubes(version, Cube(NEIGHBOURHOOD_DIMS, self.neighbourhood.table),
+                               Cube(AMENITY_DIMS, self.amenity.table), self.rows)
+        stale = previous_rows.loc[changed.append(removed)]
+        if len(stale):
+            cubes.update(stale, sign=-1)
+        fresh = rows.loc[changed.append(added)]
+        if len(fresh):
+            cubes.update(fresh)
+        return cubes, {'added': len(added), 'changed': len(changed), 'removed': len(removed)}
+
+    # Instant lookups for the app
+
+    def overall(self):
+        return self.neighbourhood.rollup([]).iloc[0]
+
+    def hotspots(self, property_category=None, price_range=None, min_listings=10, n=10):
+        """Neighbourhoods with the best mean rating among those with enough listings."""
+        stats = self.neighbourhood.rollup(['neighbourhood'], property_category=property_category, price_range=price_range)
+        stats = stats[stats['listings'] >= min_listings]
+        return stats.sort_values('mean_rating', ascending=False).head(n)
+
+    def price_ranges(self, neighbourhood=None, property_category=None):
+        """Listings and ratings per price range, in price order."""
+        stats = self.neighbourhood.rollup(['price_range'], neighbourhood=neighbourhood, property_category=property_category)
+        return stats.reindex([label for label in PRICE_LABELS if label in stats.index])
+
+    def amenity_impact(self, min_listings=20, n=15):
+        """Amenities ranked by how far the mean rating of listings with them is above the overall mean."""
+        stats = self.amenity.stats()
+        stats = stats[stats['listings'] >= min_listings].copy()
+        stats['rating_lift'] = stats['mean_rating'] - self.overall()['mean_rating']
+        return stats.sort_values('rating_lift', ascending=False).head(n)
+
+    # Persistence
+
+    def save(self, path, rows=None):
+        """
+        Write the cubes to the directory `path`, replacing it atomically,
+        with the `tracked_rows` they were built from when given.
+        """
+        tmp_dir = f"{path}.{os.getpid()}.tmp"
+        os.makedirs(tmp_dir)
+        self.neighbourhood.table.reset_index().to_parquet(os.path.join(tmp_dir, CUBE_FILES['neighbourhood']))
+        self.amenity.table.reset_index().to_parquet(os.path.join(tmp_dir, CUBE_FILES['amenity']))
+        if rows is not None:
+            rows.reset_index().to_parquet(os.path.join(tmp_dir, ROWS_FILE), index=False)
+        with open(os.path.join(tmp_dir, META_FILE), 'w') as f:
+            json.dump({'version': self.version, 'rows': self.rows}, f)
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.rename(tmp_dir, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(os.path.join(path, META_FILE)) as f:
+            meta = json.load(f)
+        neighbourhood = pd.read_parquet(os.path.join(path, CUBE_FILES['neighbourhood'])).set_index(NEIGHBOURHOOD_DIMS)
+        amenity = pd.read_parquet(os.path.join(path, CUBE_FILES['amenity'])).set_index(AMENITY_DIMS)
+        return cls(meta['version'], Cube(NEIGHBOURHOOD_DIMS, neighbourhood), Cube(AMENITY_DIMS, amenity), meta['rows'])
+
+
+def _cube_prefix(source_path, cube_dir=None):
+    name = source_path.replace('/', '_').replace('\\', '_')
+    return os.path.join(cube_dir or CUBE_DIR, f"{name}-")
+
+
+def cube_path(source_path, version, cube_dir=None):
+    """Directory of the cubes built from `version` of `source_path`."""
+    digest = hashlib.sha1(version.encode('utf-8')).hexdigest()[:16]
+    return _cube_prefix(source_path, cube_dir) + digest
+
+
+def load_cubes(source_path, version, cube_dir=None):
+    """Cubes already built for `version` of `source_path`, or None."""
+    path = cube_path(source_path, version, cube_dir)
+    return AnalyticsCubes.load(path) if os.path.isdir(path) else None
+
+
+def _cube_paths(source_path, cube_dir=None):
+    """Cube directories of every version of `source_path`, newest first."""
+    pattern = glob.escape(_cube_prefix(source_path, cube_dir)) + '?' * 16
+    paths = [p for p in glob.glob(pattern) if os.path.isdir(p)]
+    return sorted(paths, key=os.path.getmtime, reverse=True)
+
+
+def update_cubes(source_path, version, listings, cube_dir=None):
+    """
+    Build and save the cubes of `version` of `source_path` from its `listings`.
+
+    When `listings` have ids and the cubes of an earlier version were
+    saved with their rows, the new cubes are derived from those by id,
+    aggregating only the added, changed and removed listings; otherwise
+    they are built from scratch. Older versions are deleted once saved.
+    A failed save still returns the cubes.
+    """
+    rows = tracked_rows(listings) if 'id' in listings.columns else None
+    cubes = None
+    if rows is not None:
+        for previous_path in _cube_paths(source_path, cube_dir):
+            rows_path = os.path.join(previous_path, ROWS_FILE)
+            if previous_path == cube_path(source_path, version, cube_dir) or not os.path.exists(rows_path):
+                continue
+            previous_rows = pd.read_parquet(rows_path).set_index('id')
+            # Rows of another column selection of the file cannot be compared
+            if list(previous_rows.columns) == list(rows.columns):
+                cubes, counts = AnalyticsCubes.load(previous_path).derive(previous_rows, rows, version)
+                print(f"Derived cubes of {source_path} from the previous version: "
+                      f"{counts['added']} added, {counts['changed']} changed, {counts['removed']} removed")
+            break
+    if cubes is None:
+        table = listings if rows is None else rows
+        cubes = AnalyticsCubes.build(table.iloc[start:start + CHUNK_ROWS] for start in range(0, len(table), CHUNK_ROWS))
+        cubes.version = version
+
+    path = cube_path(source_path, version, cube_dir)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        cubes.save(path, rows)
+    except OSError as e:
+        print(f"Could not save the cubes to {path}: {e}")
+        return cubes
+    for stale in _cube_paths(source_path, cube_dir):
+        if stale != path:
+            shutil.rmtree(stale, ignore_errors=True)
+    return cubes
+
+
+def _source_chunks(b2, source_path, chunksize=CHUNK_ROWS):
+    """Chunks of every column the cubes read; `b2` None reads a local file."""
+    if os.path.splitext(source_path)[1].lower() in STREAMING_EXTENSIONS:
+        columns = [c for names in SOURCE_COLUMNS.values() for c in names]
+        yield from iter_source_chunks(b2, source_path, columns, chunksize)
+        return
+    if b2 is None:
+        with open(source_path, 'rb') as f:
+            data = read_source(f.read(), source_path)
+    else:
+        data = read_source(b2.get_object(source_path).read(), source_path)
+    for start in range(0, len(data), chunksize):
+        yield data.iloc[start:start + chunksize]
+
+
+def build_cubes(source_path, b2=None, cube_dir=None):
+    """
+    Build and save the cubes of a listing file's current version, streaming it in chunks.
+
+    Every chunk is folded into the cubes as it arrives, so the file never
+    has to fit in memory. The listing rows are not kept, so the app builds
+    the next version's cubes from scratch rather than by id, see
+    `update_cubes`.
+
+    Parameters
+    ----------
+    source_path : str
+        Listing file in the bucket, or a local file when `b2` is None.
+    b2 : utils.b2.B2, optional
+        Connection with the bucket selected.
+    """
+    if b2 is None:
+        stat = os.stat(source_path)
+        version = f"{stat.st_mtime_ns}-{stat.st_size}"
+        source_path = os.path.abspath(source_path)
+    else:
+        version = snapshot_version(b2.head(source_path))
+    cubes = AnalyticsCubes.build(_source_chunks(b2, source_path), version)
+    path = cube_path(source_path, version, cube_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    cubes.save(path)
+    for stale in _cube_paths(source_path, cube_dir):
+        if stale != path:
+            shutil.rmtree(stale, ignore_errors=True)
+    print(f"Built cubes of {cubes.rows} listings: {len(cubes.neighbourhood.table)} neighbourhood cells, "
+          f"{len(cubes.amenity.table)} amenities, saved to {path}")
+    return cubes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the neighbourhood and amenity insight cubes.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    build_parser = sub.add_parser('build', help="Aggregate the current version of a listing file")
+    build_parser.add_argument('--data', help="Local listing file instead of LISTINGS_FILE in the bucket")
+    args = parser.parse_args()
+
+    if args.data:
+        build_cubes(args.data)
+    else:
+        from utils.modeling_sentiment import get_b2
+        build_cubes(os.getenv('LISTINGS_FILE', 'Cleaned_Austin_AirBnB.xlsx'), get_b2())
@@ -0,0 +1,149 @@
+import numpy as np
+import pandas as pd
+
+# Grid cell size in degrees for each map zoom level, coarse to fine
+GRID_LEVELS = {8: 0.08, 10: 0.02, 12: 0.005, 14: 0.00125}
+
+# From this zoom on, listings are drawn individually when few enough match
+POINT_ZOOM = 14
+
+# Upper bound on the rows sent to the browser for one map
+MAX_POINTS = 2000
+
+TOOLTIP_COLUMNS = ['name', 'price', 'review_scores_rating']
+
+# Packs a (row, col) grid coordinate into one int64
+_COL_BITS = 21
+_COL_OFFSET = 1 << (_COL_BITS - 1)
+
+
+class GeoGrid(object):
+    def __init__(self, data, levels=GRID_LEVELS):
+        """
+        Spatial grid over the listing coordinates of one snapshot.
+
+        The cell of every listing is computed once per grid level, so
+        aggregating a search result is a grouped count over row positions.
+
+        Parameters
+        ----------
+        data : pandas.DataFrame
+            Listings with `latitude` and `longitude` columns.
+        levels : dict, optional
+            Map zoom level -> cell size in degrees.
+        """
+        self.levels = dict(sorted(levels.items()))
+        self.lat = pd.to_numeric(data['latitude'], errors='coerce').to_numpy(dtype=float)
+        self.lon = pd.to_numeric(data['longitude'], errors='coerce').to_numpy(dtype=float)
+        self.valid = np.isfinite(self.lat) & np.isfinite(self.lon)
+        self.price = self._numeric(data, 'price')
+        self.rating = self._numeric(data, 'review_scores_rating')
+        # Only the tooltip values are kept, not a reference to the snapshot
+        self.name = data['name'].to_numpy(dtype=object) if 'name' in data.columns else None
+        self.tooltip_columns = [c for c in TOOLTIP_COLUMNS if c in data.columns]
+
+        lat = np.where(self.valid, self.lat, 0)
+        lon = np.where(self.valid, self.lon, 0)
+        self.cells = {
+            zoom: np.floor(lat / size).astype(np.int64) * (1 << _COL_BITS)
+            + np.floor(lon / size).astype(np.int64) + _COL_OFFSET
+            for zoom, size in self.levels.items()
+        }
+
+    @staticmethod
+    def _numeric(data, col):
+        if col not in data.columns:
+            return np.full(len(data), np.nan)
+        return pd.to_numeric(data[col], errors='coerce').to_numpy(dtype=float)
+
+    def _level(self, zoom):
+        """The finest grid level not finer than `zoom`."""
+        eligible = [z for z in self.levels if z <= zoom]
+        return eligible[-1] if eligible else next(iter(self.levels))
+
+    def aggregate(self, positions, zoom):
+        """
+        Bin the listings at `positions` on the grid for `zoom`.
+
+        Returns
+        -------
+        pandas.DataFrame
+            One row per non-empty cell with its center, `count`,
+            `median_price` and `mean_rating`.
+        """
+        positions = positions[self.valid[positions]]
+        level = self._level(zoom)
+        size = self.levels[level]
+        cells, group = np.unique(self.cells[level][positions], return_inverse=True)
+        k = len(cells)
+        count = np.bincount(group, minlength=k)
+
+        rating = self.rating[positions]
+        rated = ~np.isnan(rating)
+        rating_count = np.bincount(group[rated], minlength=k)
+        rating_sum = np.bincount(group[rated], weights=rating[rated], minlength=k)
+
+        # Median price: sort by (cell, price) and pick the middle of each cell's run
+        price = self.price[positions]
+        priced = ~np.isnan(price)
+        price_group, price = group[priced], price[priced]
+        order = np.lexsort((price, price_group))
+        price = price[order]
+        price_count = np.bincount(price_group, minlength=k)
+        start = np.cumsum(price_count) - price_count
+        lo = np.clip(start + (price_count - 1) // 2, 0, max(len(price) - 1, 0))
+        hi = np.clip(start + price_count // 2, 0, max(len(price) - 1, 0))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            median_price = np.where(price_count > 0, (price[lo] + price[hi]) / 2 if len(price) else np.nan, np.nan)
+            mean_rating = np.where(rating_count > 0, rating_sum / rating_count, np.nan)
+
+        rows = cells // (1 << _COL_BITS)
+        cols = cells % (1 << _COL_BITS) - _COL_OFFSET
+        return pd.DataFrame({
+            'latitude': (rows + 0.5) * size,
+            'longitude': (cols + 0.5) * size,
+            'count': count,
+            'median_price': median_price,
+            'mean_rating': mean_rating,
+        })
+
+    def layer_data(self, positions, zoom, max_points=MAX_POINTS):
+        """
+        Bounded map payload for the listings at `positions`.
+
+        Individual listings, with only their coordinates and tooltip
+        columns, are returned at `POINT_ZOOM` and above when there are at
+        most `max_points` of them. Otherwise grid bins are returned,
+        coarsening the grid until there are at most `max_points` bins.
+
+        Returns
+        -------
+        tuple
+            `("points" or "bins", DataFrame)`; both frames carry the tooltip
+            columns `name`, `price` and `review_scores_rating`.
+        """
+        positions = np.asarray(positions)
+        positions = positions[self.valid[positions]]
+        if zoom >= POINT_ZOOM and len(positions) <= max_points:
+            values = {'name': self.name, 'price': self.price, 'review_scores_rating': self.rating}
+            points = pd.DataFrame({'latitude': self.lat[positions], 'longitude': self.lon[positions]})
+            for col in self.tooltip_columns:
+                points[col] = values[col][positions]
+            return 'points', points
+
+        levels = [z for z in self.levels if z <= max(zoom, next(iter(self.levels)))]
+        for level in reversed(levels):
+            bins = self.aggregate(positions, level)
+            if len(bins) <= max_points or level == levels[0]:
+                break
+        bins['name'] = bins['count'].astype(str) + ' listings'
+        bins['price'] = bins['median_price'].round(2)
+        bins['review_scores_rating'] = bins['mean_rating'].round(2)
+        # Marker radius in meters, growing with the number of listings in the cell
+        bins['radius'] = np.sqrt(bins['count']) * self.levels[level] * 111_000 / 4
+        return 'bins', bins
+
+    def center(self, positions):
+        """Mean coordinates of the listings at `positions`."""
+        positions = positions[self.valid[positions]]
+        return float(self.lat[positions].mean()), float(self.lon[positions].mean())
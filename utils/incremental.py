@@ -0,0 +1,242 @@
+import os
+import sys
+import json
+
+# Add the parent directory to Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import numpy as np
+import pandas as pd
+
+from utils.sentiment import CACHE_DIR, SENTIMENT_SOURCES, add_sentiment_features
+from utils.model_registry import REGISTRY_DIR, ModelRegistry, LinearModel, Scaler
+
+# Training state carried between incremental runs
+STATE_DIR = os.getenv('AIRBNB_TRAINING_STATE', os.path.join(CACHE_DIR, 'training'))
+
+# Incremental models keep the amenity sentiment feature and skip model selection, so
+# they get a registry of their own rather than replacing the selected full model
+INCREMENTAL_REGISTRY_DIR = os.getenv('AIRBNB_INCREMENTAL_MODEL_DIR', os.path.join(REGISTRY_DIR, 'incremental'))
+INCREMENTAL_PREFIX = 'models/incremental'
+
+NUMERIC_FEATURES = [
+    'accommodates', 'bathrooms', 'bedrooms', 'beds', 'price',
+    'neighborhood_sentiment', 'host_neighbourhood_sentiment', 'amenities_sentiment'
+]
+TARGET = 'review_scores_rating'
+
+# Raw columns whose change means a listing has to be featurized again
+RAW_COLUMNS = ['accommodates', 'bathrooms', 'bedrooms', 'beds', 'price', 'property_type', TARGET] + list(SENTIMENT_SOURCES.values())
+
+
+class SufficientStats(object):
+    def __init__(self, features=None):
+        """
+        Running sums that determine a least-squares fit exactly.
+
+        With Z = [1, X], keeps n, Z^T Z, Z^T y and y^T y. The scaler's means
+        and variances and the regression coefficients are all derived from
+        them, so rows can be added or removed without revisiting the rest.
+        """
+        self.features = list(features or [])
+        k = len(self.features) + 1
+        self.ztz = np.zeros((k, k))
+        self.zty = np.zeros(k)
+        self.yty = 0.0
+
+    @property
+    def n(self):
+        return self.ztz[0, 0]
+
+    def expand(self, features):
+        """Add feature columns; existing rows are 0 in them, so the sums just gain zero rows/columns."""
+        new = [f for f in features if f not in self.features]
+        if not new:
+            return
+        numeric = [f for f in self.features + new if not f.startswith('property_type_')]
+        one_hot = sorted(f for f in self.features + new if f.startswith('property_type_'))
+        features = numeric + one_hot
+
+        positions = np.array([0] + [features.index(f) + 1 for f in self.features])
+        ztz = np.zeros((len(features) + 1, len(features) + 1))
+        zty = np.zeros(len(features) + 1)
+        ztz[np.ix_(positions, positions)] = self.ztz
+        zty[positions] = self.zty
+        self.features, self.ztz, self.zty = features, ztz, zty
+
+    def update(self, X, y, sign=1):
+        """Add (`sign=1`) or remove (`sign=-1`) rows of `X` (aligned to `features`) and `y`."""
+        Z = np.hstack([np.ones((len(X), 1)), X])
+        self.ztz += sign * (Z.T @ Z)
+        self.zty += sign * (Z.T @ y)
+        self.yty += sign * float(y @ y)
+
+    def solve(self):
+        """
+        Fit a StandardScaler + LinearRegression equivalent from the sums.
+
+        Returns
+        -------
+        tuple
+            `(model, scaler, metrics)` with `model` fitted on scaled features.
+        """
+        n = self.n
+        mean = self.ztz[0, 1:] / n
+        y_mean = self.zty[0] / n
+        var = np.diag(self.ztz)[1:] / n - mean ** 2
+        scale = np.sqrt(np.clip(var, 0, None))
+        scale[scale < 10 * np.finfo(float).eps] = 1.0  # constant columns, as StandardScaler does
+
+        # Centered cross products, then standardized
+        sxx = self.ztz[1:, 1:] - n * np.outer(mean, mean)
+        sxy = self.zty[1:] - n * mean * y_mean
+        syy = self.yty - n * y_mean ** 2
+        cxx = sxx / np.outer(scale, scale)
+        cxy = sxy / scale
+
+        coef = np.linalg.lstsq(cxx, cxy, rcond=None)[0]
+        sse = syy - 2 * coef @ cxy + coef @ cxx @ coef
+        metrics = {
+            'train_r2': float(1 - sse / syy) if syy > 0 else 0.0,
+            'train_rmse': float(np.sqrt(max(sse, 0) / n)),
+        }
+        return LinearModel(coef, float(y_mean)), Scaler(mean, scale), metrics
+
+    def save(self, path):
+        np.savez(path, ztz=self.ztz, zty=self.zty, yty=self.yty, features=np.array(self.features, dtype=str))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as npz:
+            stats = cls(npz['features'].tolist())
+            stats.ztz, stats.zty, stats.yty = npz['ztz'], npz['zty'], float(npz['yty'])
+        return stats
+
+
+def _design_matrix(rows, features):
+    """Align featurized rows (numeric features + raw property_type) to `features`."""
+    X = np.zeros((len(rows), len(features)))
+    index = {f: i for i, f in enumerate(features)}
+    for col in NUMERIC_FEATURES:
+        X[:, index[col]] = rows[col].to_numpy(dtype=float)
+    one_hot = rows['property_type'].map(lambda t: index.get(f"property_type_{t}", -1)).to_numpy()
+    known = one_hot >= 0
+    X[np.flatnonzero(known), one_hot[known]] = 1
+    return X
+
+
+class IncrementalTrainer(object):
+    def __init__(self, state_dir=STATE_DIR):
+        """
+        Keeps the model's sufficient statistics up to date across runs.
+
+        Each run compares listings by id against the last run, featurizes
+        only the new and changed ones, and updates the statistics by
+        removing the old rows and adding the new ones.
+        """
+        self.state_dir = state_dir
+        self.stats_path = os.path.join(state_dir, 'stats.npz')
+        self.rows_path = os.path.join(state_dir, 'rows.parquet')
+        self.meta_path = os.path.join(state_dir, 'state.json')
+
+        if os.path.exists(self.stats_path):
+            self.stats = SufficientStats.load(self.stats_path)
+            self.rows = pd.read_parquet(self.rows_path).set_index('id')
+            with open(self.meta_path) as f:
+                self.meta = json.load(f)
+        else:
+            self.stats = SufficientStats(NUMERIC_FEATURES)
+            self.rows = pd.DataFrame(columns=['row_hash', TARGET, 'property_type'] + NUMERIC_FEATURES)
+            self.rows.index.name = 'id'
+            self.meta = {}
+
+    def update(self, data, data_etag=None):
+        """
+        Apply the difference between `data` and the previous run.
+
+        Parameters
+        ----------
+        data : pandas.DataFrame
+            The full current training table, with an `id` column.
+        data_etag : str, optional
+            Version of the source file, recorded in the state.
+
+        Returns
+        -------
+        dict
+            Number of added, changed and removed listings.
+        """
+        if 'id' not in data.columns:
+            raise ValueError("Incremental training needs an 'id' column to track listings")
+
+        data = data.dropna().drop_duplicates('id', keep='last').set_index('id')
+        row_hash = pd.util.hash_pandas_object(data[RAW_COLUMNS], index=False)
+
+        previous = self.rows['row_hash']
+        common = data.index.intersection(previous.index)
+        changed = common[row_hash.loc[common].to_numpy() != previous.loc[common].to_numpy().astype('uint64')]
+        added = data.index.difference(previous.index)
+        removed = previous.index.difference(data.index)
+
+        # Take the outdated rows back out of the sums
+        stale = self.rows.loc[changed.append(removed)]
+        if len(stale):
+            self.stats.update(_design_matrix(stale, self.stats.features), stale[TARGET].to_numpy(dtype=float), sign=-1)
+
+        # Featurize only what is new
+        fresh = data.loc[changed.append(added)]
+        if len(fresh):
+            fresh = add_sentiment_features(fresh)
+            fresh = fresh[NUMERIC_FEATURES + ['property_type', TARGET]].assign(
+                row_hash=row_hash.loc[fresh.index],
+                property_type=fresh['property_type'].astype(str)
+            )
+            self.stats.expand([f"property_type_{t}" for t in fresh['property_type'].unique()])
+            self.stats.update(_design_matrix(fresh, self.stats.features), fresh[TARGET].to_numpy(dtype=float))
+
+        kept = self.rows.drop(changed.append(removed))
+        if len(fresh):
+            kept = pd.concat([kept, fresh[self.rows.columns]]) if len(kept) else fresh[self.rows.columns]
+        self.rows = kept
+        self.meta = {'data_etag': data_etag, 'n_rows': int(self.stats.n)}
+        return {'added': len(added), 'changed': len(changed), 'removed': len(removed)}
+
+    def save(self):
+        os.makedirs(self.state_dir, exist_ok=True)
+        tmp = f".{os.getpid()}.tmp"
+        self.stats.save(self.stats_path + tmp + '.npz')
+        self.rows.reset_index().to_parquet(self.rows_path + tmp, index=False)
+        with open(self.meta_path + tmp, 'w') as f:
+            json.dump(self.meta, f)
+        os.replace(self.stats_path + tmp + '.npz', self.stats_path)
+        os.replace(self.rows_path + tmp, self.rows_path)
+        os.replace(self.meta_path + tmp, self.meta_path)
+
+
+def train_incremental(data, data_etag=None, registry=None, state_dir=STATE_DIR):
+    """
+    Update the training state with `data` and save the refitted model.
+
+    Returns
+    -------
+    str or None
+        The new version in the incremental registry (`registry`, by default
+        the one in `INCREMENTAL_REGISTRY_DIR`), or None when the source
+        file's ETag is the same as on the last run.
+    """
+    trainer = IncrementalTrainer(state_dir)
+    if data_etag is not None and trainer.meta.get('data_etag') == data_etag:
+        print("Training data unchanged since the last run, nothing to do.")
+        return None
+
+    delta = trainer.update(data, data_etag)
+    print(f"Incremental update: {delta['added']} added, {delta['changed']} changed, {delta['removed']} removed")
+
+    model, scaler, metrics = trainer.stats.solve()
+    registry = registry or ModelRegistry(INCREMENTAL_REGISTRY_DIR, remote_prefix=INCREMENTAL_PREFIX)
+    version = registry.save(
+        model, scaler, trainer.stats.features,
+        n_rows=int(trainer.stats.n), metrics=dict(metrics, **delta), data_etag=data_etag
+    )
+    trainer.save()
+    return version
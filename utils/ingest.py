@@ -0,0 +1,194 @@
+import os
+import json
+import shutil
+import tempfile
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Rows parsed, cleaned and written at a time
+CHUNK_ROWS = 100_000
+
+# Columns read by the Buyer Page, Data Preview and the Insights cubes
+APP_COLUMNS = [
+    'id', 'name', 'listing_url', 'price', 'review_scores_rating',
+    'property_type', 'bedrooms', 'latitude', 'longitude',
+    'neighbourhood_cleansed', 'neighbourhood', 'host_neighbourhood', 'amenities'
+]
+
+# Columns read by train_and_save_model
+TRAINING_COLUMNS = [
+    'id', 'accommodates', 'bathrooms', 'bedrooms', 'beds', 'price', 'property_type',
+    'review_scores_rating', 'neighborhood_overview', 'host_neighbourhood', 'amenities'
+]
+
+NUMERIC_COLUMNS = [
+    'id', 'price', 'review_scores_rating', 'bedrooms', 'latitude', 'longitude',
+    'accommodates', 'bathrooms', 'beds'
+]
+
+# Narrow dtypes applied once a chunk has no missing values left
+COLUMN_DTYPES = {
+    'id': 'int64',
+    'bedrooms': 'int8',
+    'latitude': 'float32',
+    'longitude': 'float32',
+}
+
+# Stored as strings and turned into pandas categories when loaded
+CATEGORY_COLUMNS = ['property_type']
+
+# Only aggregated by the cubes, a listing missing them is still kept
+OPTIONAL_COLUMNS = ['neighbourhood_cleansed', 'neighbourhood', 'host_neighbourhood', 'amenities']
+
+STREAMING_EXTENSIONS = ('.csv', '.parquet')
+
+
+def iter_source_chunks(b2, remote_path, columns, chunksize=CHUNK_ROWS, meta=None):
+    """
+    Read `remote_path` from the selected bucket a chunk at a time.
+
+    CSV files are parsed straight off the response stream. Parquet needs
+    random access, so it is downloaded to disk first and read one batch of
+    row groups at a time. Only `columns` are parsed in both cases. With
+    `b2` set to None, `remote_path` is read from the local filesystem.
+    A `meta` dict receives the "ETag" of the object version being read.
+    """
+    meta = {} if meta is None else meta
+    ext = os.path.splitext(remote_path)[1].lower()
+    if ext == '.csv':
+        if b2 is None:
+            body = remote_path
+        else:
+            response = b2.bucket.Object(remote_path).get()
+            body = response['Body']
+            meta['ETag'] = response['ETag']
+        # Ids are parsed by prepare_chunk, a missing one would turn the column into float64 here
+        yield from pd.read_csv(body, usecols=lambda c: c in columns, chunksize=chunksize, dtype={'id': str})
+    elif ext == '.parquet':
+        tmp_dir = None
+        if b2 is None:
+            path = remote_path
+        elif b2.cache_dir is not None:
+            path, meta['ETag'] = b2.download_version(remote_path)
+        else:
+            tmp_dir = tempfile.mkdtemp()
+            path = os.path.join(tmp_dir, 'source.parquet')
+            # One GET, so the ETag is the one of the bytes written
+            response = b2.bucket.Object(remote_path).get()
+            meta['ETag'] = response['ETag']
+            with open(path, 'wb') as f:
+                shutil.copyfileobj(response['Body'], f, 1024 * 1024)
+        try:
+            parquet = pq.ParquetFile(path)
+            present = [c for c in columns if c in parquet.schema_arrow.names]
+            for batch in parquet.iter_batches(batch_size=chunksize, columns=present):
+                # Nullable integers, so nulls do not send large ids through float64
+                yield batch.to_pandas(types_mapper={pa.int64(): pd.Int64Dtype()}.get)
+        finally:
+            if tmp_dir is not None:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+    else:
+        raise ValueError(f"Streaming is only supported for CSV and Parquet files: {remote_path}")
+
+
+def prepare_chunk(chunk, columns):
+    """Keep `columns`, coerce types, drop rows missing a required column and narrow dtypes."""
+    chunk = chunk[[c for c in columns if c in chunk.columns]]
+
+    if 'price' in chunk.columns and not pd.api.types.is_numeric_dtype(chunk['price']):
+        chunk = chunk.assign(price=chunk['price'].astype(str).str.replace(r'[$,]', '', regex=True))
+    if 'id' in chunk.columns:
+        # Parsed as nullable integers and dropped when missing, so large ids keep full precision
+        ids = pd.to_numeric(chunk['id'], errors='coerce', dtype_backend='numpy_nullable')
+        chunk = chunk.assign(id=ids)[ids.notna().to_numpy()]
+    numeric = [c for c in NUMERIC_COLUMNS if c in chunk.columns and c != 'id']
+    # Columns left wide are float64 in every chunk: the file's schema comes from the first
+    # one, where a column with only whole numbers so far would otherwise be int64
+    chunk = chunk.assign(**{
+        c: pd.to_numeric(chunk[c], errors='coerce').astype('float64') if c not in COLUMN_DTYPES
+        else pd.to_numeric(chunk[c], errors='coerce')
+        for c in numeric
+    })
+
+    chunk = chunk.dropna(subset=[c for c in chunk.columns if c not in OPTIONAL_COLUMNS])
+    return chunk.astype({c: t for c, t in COLUMN_DTYPES.items() if c in chunk.columns})
+
+
+def stream_listings(b2, remote_path, columns=APP_COLUMNS, derive=None, chunksize=CHUNK_ROWS, meta=None):
+    """
+    Yield cleaned chunks of a remote CSV/Parquet listing file.
+
+    Parameters
+    ----------
+    b2 : utils.b2.B2
+        Connection with the bucket selected.
+    remote_path : str
+        Name of the listing file in the bucket.
+    columns : list of str, optional
+        Columns to keep, defaults to the ones the app uses.
+    derive : callable, optional
+        Applied to each prepared chunk to add derived features.
+    chunksize : int, optional
+        Rows per chunk.
+    meta : dict, optional
+        Receives the "ETag" of the object version read, see `iter_source_chunks`.
+    """
+    for chunk in iter_source_chunks(b2, remote_path, columns, chunksize, meta):
+        chunk = prepare_chunk(chunk, columns)
+        if derive is not None:
+            chunk = derive(chunk)
+        yield chunk
+
+
+def write_chunks(chunks, path, metadata=None):
+    """
+    Write DataFrame chunks to an Arrow IPC file as they arrive.
+
+    Category columns are written as strings and listed in the schema
+    metadata, so `read_snapshot` can restore them. `metadata` adds further
+    schema metadata entries (bytes -> bytes).
+
+    Returns
+    -------
+    int
+        Number of rows written.
+    """
+    sink = None
+    writer = None
+    rows = 0
+    try:
+        for chunk in chunks:
+            if not len(chunk):
+                continue
+            chunk = chunk.astype({c: str for c in CATEGORY_COLUMNS if c in chunk.columns})
+            if writer is None:
+                categories = [c for c in CATEGORY_COLUMNS if c in chunk.columns]
+                schema = pa.Schema.from_pandas(chunk, preserve_index=False).with_metadata(
+                    {b'categories': json.dumps(categories).encode('utf-8'), **(metadata or {})}
+                )
+                sink = pa.OSFile(path, 'wb')
+                writer = pa.ipc.new_file(sink, schema)
+            writer.write_table(pa.Table.from_pandas(chunk, preserve_index=False).cast(schema))
+            rows += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+        if sink is not None:
+            sink.close()
+
+    if writer is None:
+        raise ValueError("The listing file has no rows")
+    return rows
+
+
+def ingest_to_snapshot(b2, remote_path, path, columns=APP_COLUMNS, derive=None, chunksize=CHUNK_ROWS,
+                       metadata=None):
+    """Stream `remote_path` into a snapshot file at `path`, a chunk at a time."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    rows = write_chunks(stream_listings(b2, remote_path, columns, derive, chunksize), tmp_path, metadata)
+    os.replace(tmp_path, path)
+    print(f"Ingested {rows} rows of {remote_path}")
+    return rows
@@ -0,0 +1,174 @@
+import os
+import time
+import bisect
+import threading
+from functools import wraps
+from contextlib import contextmanager, nullcontext
+
+# Off unless AIRBNB_METRICS is set; read once at import
+ENABLED = os.getenv('AIRBNB_METRICS', '').lower() not in ('', '0', 'false', 'no')
+
+# Upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_NOOP = nullcontext()
+_lock = threading.Lock()
+_histograms = {}
+_cache_counts = {}
+_cache_sources = {}
+
+
+class Histogram(object):
+    def __init__(self, buckets=BUCKETS):
+        """
+        Cumulative latency histogram of one stage.
+
+        Parameters
+        ----------
+        buckets : tuple of float, optional
+            Upper bounds of the buckets in seconds; an implicit +Inf
+            bucket holds everything slower.
+        """
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the `q` quantile."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(self.buckets + (float('inf'),), self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+
+def observe(stage, seconds):
+    """Add one `stage` latency to its histogram."""
+    with _lock:
+        histogram = _histograms.get(stage)
+        if histogram is None:
+            histogram = _histograms[stage] = Histogram()
+        histogram.observe(seconds)
+
+
+@contextmanager
+def _timer(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start)
+
+
+def timer(stage):
+    """Context manager timing a block as `stage`; a shared no-op when metrics are off."""
+    if not ENABLED:
+        return _NOOP
+    return _timer(stage)
+
+
+def timed(stage):
+    """Decorator timing every call as `stage`; leaves the function untouched when metrics are off."""
+    def decorator(fn):
+        if not ENABLED:
+            return fn
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with _timer(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def cache_hit(cache, hit=True, n=1):
+    """Count `n` hits (or misses) of `cache`."""
+    if not ENABLED:
+        return
+    with _lock:
+        counts = _cache_counts.setdefault(cache, [0, 0])
+        counts[0 if hit else 1] += n
+
+
+def register_cache(cache, info):
+    """
+    Report an existing cache's own counters.
+
+    `info` is called when metrics are read and returns an object with
+    `hits` and `misses`, like `functools.lru_cache`'s `cache_info()`.
+    """
+    _cache_sources[cache] = info
+
+
+def cache_stats():
+    """Mapping of cache name -> (hits, misses)."""
+    with _lock:
+        stats = {cache: tuple(counts) for cache, counts in _cache_counts.items()}
+    for cache, info in _cache_sources.items():
+        current = info()
+        stats[cache] = (current.hits, current.misses)
+    return stats
+
+
+def stage_stats():
+    """Summary of every stage: count, total and mean seconds and bucketed p50/p95/p99."""
+    with _lock:
+        histograms = list(_histograms.items())
+    return {
+        stage: {
+            'count': h.count,
+            'total_seconds': h.sum,
+            'mean_seconds': h.sum / h.count if h.count else None,
+            'p50_seconds': h.quantile(0.5),
+            'p95_seconds': h.quantile(0.95),
+            'p99_seconds': h.quantile(0.99),
+        }
+        for stage, h in sorted(histograms)
+    }
+
+
+def _format_bound(bound):
+    return '+Inf' if bound == float('inf') else repr(bound)
+
+
+def prometheus_text(prefix='airbnb'):
+    """Every histogram and cache counter in the Prometheus text exposition format."""
+    lines = [
+        f"# HELP {prefix}_stage_seconds Latency of instrumented stages.",
+        f"# TYPE {prefix}_stage_seconds histogram",
+    ]
+    with _lock:
+        histograms = [(stage, list(h.counts), h.buckets, h.sum, h.count) for stage, h in sorted(_histograms.items())]
+    for stage, counts, buckets, total, count in histograms:
+        cumulative = 0
+        for bound, n in zip(buckets + (float('inf'),), counts):
+            cumulative += n
+            lines.append(f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="{_format_bound(bound)}"}} {cumulative}')
+        lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {total}')
+        lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {count}')
+
+    lines += [
+        f"# HELP {prefix}_cache_requests_total Cache lookups by result.",
+        f"# TYPE {prefix}_cache_requests_total counter",
+    ]
+    for cache, (hits, misses) in sorted(cache_stats().items()):
+        lines.append(f'{prefix}_cache_requests_total{{cache="{cache}",result="hit"}} {hits}')
+        lines.append(f'{prefix}_cache_requests_total{{cache="{cache}",result="miss"}} {misses}')
+    return '\n'.join(lines) + '\n'
+
+
+def reset():
+    """Forget every recorded latency and cache count."""
+    with _lock:
+        _histograms.clear()
+        _cache_counts.clear()
@@ -0,0 +1,225 @@
+import os
+import sys
+import json
+import shutil
+import argparse
+from datetime import datetime, timezone
+
+# Add the parent directory to Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import numpy as np
+
+# Versioned artifacts live here, one sub-directory per version
+REGISTRY_DIR = os.getenv('AIRBNB_MODEL_DIR', os.path.join(os.path.dirname(__file__), 'models'))
+
+COEFFICIENTS_FILE = 'model.npz'
+METADATA_FILE = 'metadata.json'
+CURRENT_FILE = 'current.json'
+
+
+class LinearModel(object):
+    """Minimal stand-in for a fitted LinearRegression."""
+    def __init__(self, coef, intercept):
+        self.coef_ = coef
+        self.intercept_ = intercept
+
+    def predict(self, X):
+        return np.asarray(X) @ self.coef_ + self.intercept_
+
+
+class Scaler(object):
+    """Minimal stand-in for a fitted StandardScaler."""
+    def __init__(self, mean, scale):
+        self.mean_ = mean
+        self.scale_ = scale
+
+    def transform(self, X):
+        return (np.asarray(X, dtype=float) - self.mean_) / self.scale_
+
+
+class ModelRegistry(object):
+    def __init__(self, root=REGISTRY_DIR, b2=None, remote_prefix='models'):
+        """
+        Versioned store of trained review score models.
+
+        Every version is an immutable directory holding the coefficients
+        and scaler statistics as `.npz`, plus a `metadata.json` describing
+        how it was trained. The active version is named in `current.json`,
+        which is replaced atomically so running workers swap models
+        without a restart.
+
+        Parameters
+        ----------
+        root : str, optional
+            Local registry directory.
+        b2 : utils.b2.B2, optional
+            Connection with a bucket selected; when given, every saved
+            version and activation is mirrored to it.
+        remote_prefix : str, optional
+            Folder in the bucket for the mirrored artifacts.
+        """
+        self.root = root
+        self.b2 = b2
+        self.remote_prefix = remote_prefix
+        self._current_stat = None
+        self._current_version = None
+
+    def _version_dirs(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(v for v in os.listdir(self.root) if v.startswith('v') and v[1:].isdigit())
+
+    def versions(self):
+        """Saved versions, oldest first; a version still being written is left out."""
+        return [v for v in self._version_dirs() if os.path.exists(os.path.join(self.root, v, METADATA_FILE))]
+
+    def _reserve_version(self):
+        # Creating the directory claims the number, so concurrent trainings never share one
+        os.makedirs(self.root, exist_ok=True)
+        while True:
+            existing = self._version_dirs()
+            version = f"v{int(existing[-1][1:]) + 1 if existing else 1:04d}"
+            try:
+                os.mkdir(os.path.join(self.root, version))
+                return version
+            except FileExistsError:
+                continue
+
+    def _mirror(self, local_path, remote_path):
+        if self.b2 is not None:
+            self.b2.file_to_b2(local_path, f"{self.remote_prefix}/{remote_path}")
+
+    def save(self, model, scaler, expected_features, n_rows=None, metrics=None, data_etag=None, activate=True,
+             model_selection=None):
+        """
+        Store a trained model as a new version.
+
+        `model_selection` is the cross-validation summary of the candidates
+        the model was picked from, kept in the metadata.
+
+        Returns
+        -------
+        str
+            The new version name, e.g. "v0003".
+        """
+        version = self._reserve_version()
+        version_dir = os.path.join(self.root, version)
+
+        coef = np.asarray(model.coef_, dtype=float).ravel()
+        mean = getattr(scaler, 'mean_', None)
+        scale = getattr(scaler, 'scale_', None)
+        metadata = {
+            'version': version,
+            'created': datetime.now(timezone.utc).isoformat(),
+            'features': list(expected_features),
+            'n_rows': n_rows,
+            'metrics': metrics or {},
+            'data_etag': data_etag,
+        }
+        if model_selection is not None:
+            metadata['model_selection'] = model_selection
+
+        # The metadata goes in last and atomically: until then the version is not listed
+        try:
+            np.savez(
+                os.path.join(version_dir, COEFFICIENTS_FILE),
+                coef=coef,
+                intercept=np.float64(np.ravel(model.intercept_)[0]),
+                mean=np.zeros_like(coef) if mean is None else np.asarray(mean, dtype=float),
+                scale=np.ones_like(coef) if scale is None else np.asarray(scale, dtype=float),
+                features=np.array(expected_features, dtype=str),
+            )
+            tmp_path = os.path.join(version_dir, f"{METADATA_FILE}.tmp")
+            with open(tmp_path, 'w') as f:
+                json.dump(metadata, f, indent=2)
+            os.replace(tmp_path, os.path.join(version_dir, METADATA_FILE))
+        except BaseException:
+            shutil.rmtree(version_dir, ignore_errors=True)
+            raise
+
+        for name in (COEFFICIENTS_FILE, METADATA_FILE):
+            self._mirror(os.path.join(self.root, version, name), f"{version}/{name}")
+        print(f"Saved model {version} to {self.root}")
+
+        if activate:
+            self.activate(version)
+        return version
+
+    def activate(self, version):
+        """Atomically point `current.json` at `version`."""
+        if version not in self.versions():
+            raise ValueError(f"Unknown model version: {version}")
+        path = os.path.join(self.root, CURRENT_FILE)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': version}, f)
+        os.replace(tmp_path, path)
+        self._mirror(path, CURRENT_FILE)
+
+    def current_version(self):
+        """
+        The active version, or None when nothing has been activated.
+
+        Only re-reads `current.json` when its mtime or inode changes, so it
+        is cheap enough to call on every request.
+        """
+        path = os.path.join(self.root, CURRENT_FILE)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        stat = (st.st_ino, st.st_mtime_ns)
+        if stat != self._current_stat:
+            with open(path) as f:
+                self._current_version = json.load(f)['version']
+            self._current_stat = stat
+        return self._current_version
+
+    def metadata(self, version):
+        with open(os.path.join(self.root, version, METADATA_FILE)) as f:
+            return json.load(f)
+
+    def load(self, version=None):
+        """
+        Load a version (the active one by default).
+
+        Returns
+        -------
+        tuple
+            `(model, scaler, expected_features)`, usable like the
+            unpickled sklearn objects.
+        """
+        version = version or self.current_version()
+        if version is None:
+            raise FileNotFoundError(f"No active model in {self.root}")
+        with np.load(os.path.join(self.root, version, COEFFICIENTS_FILE)) as npz:
+            model = LinearModel(npz['coef'], float(npz['intercept']))
+            scaler = Scaler(npz['mean'], npz['scale'])
+            expected_features = npz['features'].tolist()
+        return model, scaler, expected_features
+
+    def remove(self, version):
+        if version == self.current_version():
+            raise ValueError("Cannot remove the active model version")
+        shutil.rmtree(os.path.join(self.root, version))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect and switch trained model versions.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('list', help="List saved versions")
+    activate_parser = sub.add_parser('activate', help="Make a version the active model")
+    activate_parser.add_argument('version')
+    args = parser.parse_args()
+
+    registry = ModelRegistry()
+    if args.command == 'list':
+        current = registry.current_version()
+        for v in registry.versions():
+            meta = registry.metadata(v)
+            marker = '*' if v == current else ' '
+            print(f"{marker} {v}  {meta['created']}  rows={meta['n_rows']}  metrics={meta['metrics']}")
+    else:
+        registry.activate(args.version)
+        print(f"Activated {args.version}")
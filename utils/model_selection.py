@@ -0,0 +1,198 @@
+import os
+import json
+import time
+import shutil
+import tempfile
+import importlib
+from itertools import product
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy import sparse
+
+from utils.amenities import AMENITY_PREFIX
+
+# Only linear models: the registry and BatchScorer keep one coefficient per feature
+CANDIDATES = {
+    'linear': ('sklearn.linear_model', 'LinearRegression', {}),
+    'ridge_1': ('sklearn.linear_model', 'Ridge', {'alpha': 1.0}),
+    'ridge_10': ('sklearn.linear_model', 'Ridge', {'alpha': 10.0}),
+    'lasso': ('sklearn.linear_model', 'Lasso', {'alpha': 0.001, 'max_iter': 5000}),
+}
+
+# Feature sets, as the prefixes of the features they leave out
+FEATURE_SETS = {
+    'all': (),
+    'no_amenities': (AMENITY_PREFIX,),
+    'no_sentiment': ('neighborhood_sentiment', 'host_neighbourhood_sentiment'),
+    'numeric': (AMENITY_PREFIX, 'property_type_'),
+}
+
+FOLDS = 5
+
+# Arrays memory-mapped by the worker processes, one load per process
+_shared = {}
+
+
+def make_model(name):
+    """A new, unfitted estimator of candidate `name`."""
+    module, cls, params = CANDIDATES[name]
+    return getattr(importlib.import_module(module), cls)(**params)
+
+
+def feature_columns(features, feature_set):
+    """Positions of the `features` kept by `feature_set`."""
+    excluded = FEATURE_SETS[feature_set]
+    return [i for i, f in enumerate(features) if not (excluded and f.startswith(excluded))]
+
+
+def _load(workdir):
+    if workdir not in _shared:
+        with open(os.path.join(workdir, 'features.json')) as f:
+            features = json.load(f)
+        arrays = {
+            name: np.load(os.path.join(workdir, f"{name}.npy"), mmap_mode='r')
+            for name in ('dense', 'y', 'folds', 'amenity_data', 'amenity_indices', 'amenity_indptr')
+        }
+        arrays['amenities'] = sparse.csr_matrix(
+            (arrays.pop('amenity_data'), arrays.pop('amenity_indices'), arrays.pop('amenity_indptr')),
+            shape=(len(arrays['y']), len(features['amenity']))
+        )
+        _shared.clear()
+        _shared[workdir] = (features, arrays)
+    return _shared[workdir]
+
+
+def design_matrix(dense, amenities, rows, dense_cols, amenity_cols, mean, scale):
+    """Rows of the standardized dense features, with the chosen amenity columns appended unscaled."""
+    X = (dense[np.ix_(rows, dense_cols)] - mean) / scale
+    if not amenity_cols:
+        return X
+    return sparse.hstack([sparse.csr_matrix(X), amenities[rows][:, amenity_cols]], format='csr')
+
+
+def _evaluate(workdir, model_name, feature_set, fold):
+    """Fit on every fold but `fold` and score on it."""
+    features, arrays = _load(workdir)
+    dense_cols = feature_columns(features['dense'], feature_set)
+    amenity_cols = feature_columns([AMENITY_PREFIX + t for t in features['amenity']], feature_set)
+    test = np.flatnonzero(arrays['folds'] == fold)
+    train = np.flatnonzero(arrays['folds'] != fold)
+
+    # The scaler is fitted on the training rows only, like the final model
+    train_dense = arrays['dense'][np.ix_(train, dense_cols)]
+    mean = train_dense.mean(axis=0)
+    scale = train_dense.std(axis=0)
+    scale[scale == 0] = 1.0
+    X_train = design_matrix(arrays['dense'], arrays['amenities'], train, dense_cols, amenity_cols, mean, scale)
+    X_test = design_matrix(arrays['dense'], arrays['amenities'], test, dense_cols, amenity_cols, mean, scale)
+    y_train, y_test = arrays['y'][train], arrays['y'][test]
+
+    model = make_model(model_name)
+    start = time.perf_counter()
+    model.fit(X_train, y_train)
+    fit_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    y_pred = model.predict(X_test)
+    predict_seconds = time.perf_counter() - start
+
+    residual = ((y_test - y_pred) ** 2).sum()
+    total = ((y_test - y_test.mean()) ** 2).sum()
+    return {
+        'model': model_name,
+        'features': feature_set,
+        'fold': fold,
+        'r2': float(1 - residual / total) if total > 0 else None,
+        'rmse': float(np.sqrt(residual / len(y_test))),
+        'fit_seconds': fit_seconds,
+        'predict_seconds': predict_seconds,
+        'n_features': len(dense_cols) + len(amenity_cols),
+    }
+
+
+def _summarize(results):
+    summary = []
+    for key in dict.fromkeys((r['model'], r['features']) for r in results):
+        runs = [r for r in results if (r['model'], r['features']) == key]
+        r2 = [r['r2'] for r in runs if r['r2'] is not None]
+        rmse = [r['rmse'] for r in runs]
+        summary.append({
+            'model': key[0],
+            'features': key[1],
+            'n_features': runs[0]['n_features'],
+            'r2_mean': float(np.mean(r2)) if r2 else None,
+            'r2_std': float(np.std(r2)) if r2 else None,
+            'rmse_mean': float(np.mean(rmse)),
+            'rmse_std': float(np.std(rmse)),
+            'fit_seconds': float(np.mean([r['fit_seconds'] for r in runs])),
+            'predict_seconds': float(np.mean([r['predict_seconds'] for r in runs])),
+        })
+    return sorted(summary, key=lambda s: s['rmse_mean'])
+
+
+def cross_validate(dense, amenities, y, dense_features, amenity_vocabulary,
+                   candidates=None, feature_sets=None, folds=FOLDS, processes=None, seed=0):
+    """
+    K-fold cross-validation of every candidate model on every feature set.
+
+    The featurized matrix is written once to a scratch directory as
+    `.npy` files (the amenity matrix as its CSR arrays) and memory-mapped
+    by the worker processes, so it is neither pickled per task nor copied
+    per fold beyond the rows each fit needs. Every (model, feature set,
+    fold) is one task on a process pool.
+
+    Parameters
+    ----------
+    dense : numpy.ndarray
+        Unscaled dense features, one column per `dense_features`.
+    amenities : scipy.sparse.csr_matrix
+        Amenity indicators, one column per `amenity_vocabulary` token.
+    y : numpy.ndarray
+        Target review scores.
+    candidates, feature_sets : list of str, optional
+        Names from `CANDIDATES` and `FEATURE_SETS`, all by default.
+    folds : int, optional
+        Number of folds.
+    processes : int, optional
+        Pool size, defaults to the number of CPUs; 1 runs in this process.
+    seed : int, optional
+        Seed of the random fold assignment.
+
+    Returns
+    -------
+    list of dict
+        One entry per (model, feature set) with the mean and standard
+        deviation of the R^2 and RMSE over the folds and the mean fit and
+        predict seconds per fold, best (lowest RMSE) first.
+    """
+    candidates = candidates or list(CANDIDATES)
+    feature_sets = feature_sets or list(FEATURE_SETS)
+    amenities = sparse.csr_matrix(amenities)
+    fold_ids = np.random.default_rng(seed).permutation(len(y)) % folds
+
+    workdir = tempfile.mkdtemp(prefix='model_selection-')
+    try:
+        np.save(os.path.join(workdir, 'dense.npy'), np.ascontiguousarray(dense, dtype=float))
+        np.save(os.path.join(workdir, 'y.npy'), np.asarray(y, dtype=float))
+        np.save(os.path.join(workdir, 'folds.npy'), fold_ids.astype(np.int16))
+        np.save(os.path.join(workdir, 'amenity_data.npy'), amenities.data)
+        np.save(os.path.join(workdir, 'amenity_indices.npy'), amenities.indices)
+        np.save(os.path.join(workdir, 'amenity_indptr.npy'), amenities.indptr)
+        with open(os.path.join(workdir, 'features.json'), 'w') as f:
+            json.dump({'dense': list(dense_features), 'amenity': list(amenity_vocabulary)}, f)
+
+        tasks = list(product([workdir], candidates, feature_sets, range(folds)))
+        if processes == 1:
+            results = [_evaluate(*task) for task in tasks]
+        else:
+            with ProcessPoolExecutor(max_workers=processes) as pool:
+                results = list(pool.map(_evaluate, *zip(*tasks)))
+    finally:
+        _shared.pop(workdir, None)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    summary = _summarize(results)
+    for s in summary:
+        print(f"CV {s['model']:10s} {s['features']:14s} rmse={s['rmse_mean']:.4f}±{s['rmse_std']:.4f} "
+              f"fit={s['fit_seconds'] * 1000:.1f} ms")
+    return summary
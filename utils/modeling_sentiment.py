@@ -1,37 +1,68 @@
 import os
 import sys
+import argparse
 from io import BytesIO
 
 # Add the parent directory to Python path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 import pickle
+import numpy as np
 import pandas as pd
-from sklearn.linear_model import LinearRegression
-from sklearn.preprocessing import StandardScaler
 from dotenv import load_dotenv
-from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
-from utils.b2 import B2
+from utils.sentiment import SENTIMENT_SOURCES, add_sentiment_features
+from utils.amenities import AMENITY_PREFIX, amenity_features
+from utils import model_selection
+from utils.model_registry import ModelRegistry
+from utils.snapshot import load_snapshot
+from utils.incremental import INCREMENTAL_PREFIX, INCREMENTAL_REGISTRY_DIR, train_incremental
+from utils.ingest import STREAMING_EXTENSIONS, TRAINING_COLUMNS, stream_listings
+
+# Training data in the bucket, Excel or (streamed in chunks) CSV/Parquet
+TRAINING_FILE = os.getenv('TRAINING_FILE', 'Final_PROJ.xlsx')
+
+# Amenities enter the model as sparse indicators rather than a sentiment score
+TEXT_SENTIMENT = {f: src for f, src in SENTIMENT_SOURCES.items() if src != 'amenities'}
+
+def get_b2():
+    """Backblaze connection from the environment, with the bucket selected."""
+    from utils.b2 import B2  # boto3 is only imported when the bucket is needed
+    load_dotenv()  # Load environment variables
+
+    # Set up Backblaze connection
+    b2 = B2(
+        endpoint=os.getenv('B2_ENDPOINT'),
+        key_id=os.getenv('B2_KEYID'),
+        secret_key=os.getenv('B2_APPKEY')
+    )
+
+    # Set the bucket
+    bucket_name = os.getenv('B2_BUCKETNAME')
+    if not bucket_name:
+        raise ValueError("Bucket name not found in environment variables")
+
+    b2.set_bucket(bucket_name)
+    return b2
 
 def load_and_preprocess_data():
-    load_dotenv()  # Load environment variables
     try:
-        # Set up Backblaze connection
-        b2 = B2(
-            endpoint=os.getenv('B2_ENDPOINT'),
-            key_id=os.getenv('B2_KEYID'),
-            secret_key=os.getenv('B2_APPKEY')
-        )
-        
-        # Set the bucket
-        bucket_name = os.getenv('B2_BUCKETNAME')
-        if not bucket_name:
-            raise ValueError("Bucket name not found in environment variables")
-        
-        b2.set_bucket(bucket_name)
-        
+        b2 = get_b2()
+
+        if os.path.splitext(TRAINING_FILE)[1].lower() in STREAMING_EXTENSIONS:
+            # Clean one chunk at a time, only the training columns are kept. Texts are scored
+            # once over the whole table, so the disk cache is read and written and the
+            # process pool started a single time rather than per chunk
+            source = {}
+            data = pd.concat(stream_listings(b2, TRAINING_FILE, TRAINING_COLUMNS, meta=source), ignore_index=True)
+            data.dropna(inplace=True)  # Listings without amenities are kept by the ingest
+            data = add_sentiment_features(data, sources=TEXT_SENTIMENT)
+            # The version the rows were read from, not a later HEAD
+            data.attrs['data_etag'] = source['ETag'].strip('"')
+            print("Data loaded and preprocessed successfully.")
+            return data
+
         # Retrieve the file from Backblaze
-        obj = b2.get_object('Final_PROJ.xlsx')
+        obj, data_etag = b2.get_object_version(TRAINING_FILE)
         if obj is None:
             raise ValueError("Failed to get the object from Backblaze bucket")
         
@@ -41,20 +72,15 @@ def load_and_preprocess_data():
         file_content = obj.read()  # Read the content of StreamingBody as bytes
         data = pd.read_excel(BytesIO(file_content))  # Use BytesIO to convert to a file-like object
         
+        # Remember which version of the file the model is trained on, from the GET the rows came from
+        data.attrs['data_etag'] = data_etag
+
         # Data preprocessing
         data.dropna(inplace=True)  # Remove rows with missing values
 
-        # Sentiment Analysis for text columns
-        analyzer = SentimentIntensityAnalyzer()
-        data['neighborhood_sentiment'] = data['neighborhood_overview'].apply(
-            lambda x: analyzer.polarity_scores(x)['compound'] if isinstance(x, str) else 0
-        )
-        data['host_neighbourhood_sentiment'] = data['host_neighbourhood'].apply(
-            lambda x: analyzer.polarity_scores(x)['compound'] if isinstance(x, str) else 0
-        )
-        data['amenities_sentiment'] = data['amenities'].apply(
-            lambda x: analyzer.polarity_scores(x)['compound'] if isinstance(x, str) else 0
-        )
+        # Sentiment Analysis for text columns, deduplicated, cached on disk and
+        # spread over a process pool
+        data = add_sentiment_features(data, sources=TEXT_SENTIMENT)
 
         print("Data loaded and preprocessed successfully.")
         return data
@@ -69,7 +95,12 @@ def encode_property_type(X):
     return X
 
 # Train the model and save it as model.pickle
-def train_and_save_model():
+def train_and_save_model(incremental=False, folds=model_selection.FOLDS):
+    if incremental:
+        return train_incremental_model()
+    # Only training needs sklearn, the app loads models through load_model
+    from sklearn.preprocessing import StandardScaler
+    from utils.model_registry import Scaler
     try:
         # Load and preprocess data
         data = load_and_preprocess_data()
@@ -78,7 +109,7 @@ def train_and_save_model():
         feature_columns = [
             'accommodates', 'bathrooms', 'bedrooms', 'beds', 'price',
             'neighborhood_sentiment', 'host_neighbourhood_sentiment',
-            'amenities_sentiment', 'property_type'
+            'property_type'
         ]
         
         if 'review_scores_rating' not in data.columns:
@@ -90,28 +121,95 @@ def train_and_save_model():
         # One-hot encode 'property_type'
         X = encode_property_type(X)
 
-        # Standardize features
+        # One 0/1 column per common amenity, kept in CSR form
+        vocabulary, amenities = amenity_features(data['amenities'])
+        print(f"Amenity vocabulary: {len(vocabulary)} tokens, {amenities.nnz} indicators")
+        dense = X.to_numpy(dtype=float)
+        amenity_names = [AMENITY_PREFIX + token for token in vocabulary]
+
+        # Pick the model and feature set with the lowest cross-validated RMSE
+        selection = None
+        model_name, feature_set = 'linear', 'all'
+        if folds > 1:
+            selection = model_selection.cross_validate(
+                dense, amenities, y.to_numpy(dtype=float), list(X.columns), vocabulary, folds=folds
+            )
+            model_name, feature_set = selection[0]['model'], selection[0]['features']
+            print(f"Selected {model_name} on the '{feature_set}' features")
+        dense_cols = model_selection.feature_columns(list(X.columns), feature_set)
+        amenity_cols = model_selection.feature_columns(amenity_names, feature_set)
+
+        # Standardize the dense features, the amenity indicators are appended unscaled
         scaler = StandardScaler()
-        X_scaled = scaler.fit_transform(X)
+        scaler.fit(dense[:, dense_cols])
+        X_scaled = model_selection.design_matrix(
+            dense, amenities, np.arange(len(dense)), dense_cols, amenity_cols, scaler.mean_, scaler.scale_
+        )
 
         # Train the model
-        model = LinearRegression()
+        model = model_selection.make_model(model_name)
         model.fit(X_scaled, y)
 
-        # Save the model, scaler, and expected features to a pickle file
-        save_path = os.path.join(os.path.dirname(__file__), 'model.pickle')
-        expected_features = list(X.columns)  # Capture the expected features
-
-        with open(save_path, 'wb') as model_file:
-            pickle.dump({'model': model, 'scaler': scaler, 'expected_features': expected_features}, model_file)
+        # Save the model, scaler, and expected features as a new registry version
+        expected_features = [X.columns[i] for i in dense_cols] + [amenity_names[i] for i in amenity_cols]
+        scaler = Scaler(
+            np.concatenate([scaler.mean_, np.zeros(len(amenity_cols))]),
+            np.concatenate([scaler.scale_, np.ones(len(amenity_cols))])
+        )
+        y_pred = model.predict(X_scaled)
+        metrics = {
+            'train_r2': float(model.score(X_scaled, y)),
+            'train_rmse': float(np.sqrt(np.mean((y - y_pred) ** 2))),
+            'model': model_name,
+            'feature_set': feature_set,
+        }
+        if selection:
+            metrics.update(cv_folds=folds, cv_r2=selection[0]['r2_mean'], cv_rmse=selection[0]['rmse_mean'])
+
+        registry = ModelRegistry(b2=get_b2() if os.getenv('MODEL_MIRROR_B2') else None)
+        version = registry.save(
+            model, scaler, expected_features,
+            n_rows=len(X), metrics=metrics, data_etag=data.attrs.get('data_etag'),
+            model_selection=selection
+        )
 
-        print("Model, scaler, and expected features saved successfully as model.pickle")
+        print(f"Model, scaler, and expected features saved successfully as {version}")
 
     except Exception as e:
         print(f"Error during model training and saving: {e}")
 
+# Update the model with only the listings added or changed since the last run
+def train_incremental_model():
+    try:
+        b2 = get_b2()
+
+        # The training file is only downloaded and parsed again when its ETag changes
+        snapshot = load_snapshot(b2, TRAINING_FILE, columns=TRAINING_COLUMNS)
+        if 'review_scores_rating' not in snapshot.data.columns:
+            raise ValueError("Target column 'review_scores_rating' not found in dataset")
+
+        # Saved apart from the selected model, serve it by pointing AIRBNB_MODEL_DIR there
+        registry = ModelRegistry(INCREMENTAL_REGISTRY_DIR, b2=b2 if os.getenv('MODEL_MIRROR_B2') else None,
+                                 remote_prefix=INCREMENTAL_PREFIX)
+        version = train_incremental(snapshot.data, data_etag=snapshot.version, registry=registry)
+        if version is not None:
+            print(f"Model, scaler, and expected features saved successfully as {version}")
+
+    except Exception as e:
+        print(f"Error during incremental model training: {e}")
+
 # Function to load the trained model
-def load_model():
+def load_model(version=None):
+    """
+    Load `(model, scaler, expected_features)`.
+
+    Uses `version` of the model registry, or its active version, and falls
+    back to the legacy model.pickle when the registry is empty.
+    """
+    registry = ModelRegistry()
+    if version or registry.current_version():
+        return registry.load(version)
+
     model_path = os.path.join(os.path.dirname(__file__), 'model.pickle')
     if os.path.exists(model_path):
         with open(model_path, 'rb') as model_file:
@@ -122,4 +220,11 @@ def load_model():
         raise FileNotFoundError("model.pickle not found in the expected location")
 
 if __name__ == "__main__":
-    train_and_save_model()
+    parser = argparse.ArgumentParser(description="Train the review score model.")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Only featurize listings added or changed since the last run; the model "
+                             "goes to its own registry (AIRBNB_INCREMENTAL_MODEL_DIR)")
+    parser.add_argument('--folds', type=int, default=model_selection.FOLDS,
+                        help="Cross-validation folds for model selection, 0 or 1 fits a plain LinearRegression")
+    args = parser.parse_args()
+    train_and_save_model(incremental=args.incremental, folds=args.folds)
@@ -0,0 +1,87 @@
+import math
+
+import numpy as np
+import pandas as pd
+
+# Columns of the Buyer Page results table
+DISPLAY_COLUMNS = ['review_scores_rating', 'name', 'listing_url', 'price', 'bedrooms']
+
+PAGE_SIZE = 50
+
+
+def truncate_ids(ids, digits=5):
+    """First `digits` digits of each listing id, as strings."""
+    values = pd.to_numeric(pd.Series(ids), errors='coerce')
+    if not pd.api.types.is_integer_dtype(values):
+        # Same as int(float(x)), missing ids stay missing
+        values = np.trunc(values).astype('Int64')
+    return values.astype('string').str[:digits]
+
+
+def preview_frame(data, rows=5):
+    """The first `rows` listings with display transforms applied, built once per snapshot."""
+    preview = data.head(rows).copy()
+    if 'id' in preview.columns:
+        preview['id'] = truncate_ids(preview['id']).to_numpy()
+    return preview
+
+
+class ResultCursor(object):
+    def __init__(self, positions, version, page_size=PAGE_SIZE):
+        """
+        Server-side cursor over one Buyer Page search result.
+
+        Only the row positions of the matches are kept, so it is cheap to
+        hold in session state across reruns. Each render slices one page
+        out of the snapshot; sort orders are computed once and reused
+        while paging.
+
+        Parameters
+        ----------
+        positions : numpy.ndarray
+            Row positions of the matching listings, in their default order.
+        version : str
+            Snapshot version the positions refer to.
+        page_size : int, optional
+            Rows per page.
+        """
+        self.positions = np.asarray(positions)
+        self.version = version
+        self.page_size = page_size
+        self._orders = {}
+
+    def __len__(self):
+        return len(self.positions)
+
+    @property
+    def pages(self):
+        return max(1, math.ceil(len(self.positions) / self.page_size))
+
+    def ordered(self, data, index=None, sort_by=None, ascending=True):
+        """Positions in display order, sorted on `sort_by` when given."""
+        if sort_by is None:
+            return self.positions
+        key = (sort_by, ascending)
+        if key not in self._orders:
+            if index is not None and sort_by in index.sorted:
+                order = index.sort(self.positions, sort_by, ascending)
+            else:
+                values = data[sort_by].iloc[self.positions].reset_index(drop=True)
+                ranks = values.sort_values(ascending=ascending, kind='stable', na_position='last').index
+                order = self.positions[ranks.to_numpy()]
+            self._orders[key] = order
+        return self._orders[key]
+
+    def page(self, data, page, index=None, sort_by=None, ascending=True, columns=DISPLAY_COLUMNS):
+        """
+        Rows of one page (0-based), limited to `columns`.
+
+        Returns
+        -------
+        pandas.DataFrame
+            At most `page_size` rows.
+        """
+        page = min(max(page, 0), self.pages - 1)
+        start = page * self.page_size
+        rows = self.ordered(data, index, sort_by, ascending)[start:start + self.page_size]
+        return data.iloc[rows][[c for c in columns if c in data.columns]]
@@ -0,0 +1,217 @@
+import os
+import threading
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+import pandas as pd
+
+from utils.metrics import register_cache
+
+# Columns searched by range (kept as sorted arrays) and by equality (kept as bitmaps)
+RANGE_COLUMNS = ['price', 'review_scores_rating']
+CATEGORY_COLUMNS = ['property_type', 'bedrooms']
+
+# Memory for cached search results, shared by every session
+QUERY_CACHE_BYTES = int(os.getenv('AIRBNB_QUERY_CACHE_MB', '64')) * 1024 * 1024
+
+QueryCacheInfo = namedtuple('QueryCacheInfo', ['hits', 'misses', 'currsize', 'nbytes', 'max_bytes'])
+
+
+class ListingIndex(object):
+    def __init__(self, data):
+        """
+        Build the Buyer Page search structures over one listing snapshot.
+
+        Range columns are stored as their non-null values in sorted order
+        along with the matching row positions, so a bound becomes a binary
+        search. Category columns get one packed bitmap per distinct value.
+        The index only holds row positions, `data` is never copied.
+
+        Parameters
+        ----------
+        data : pandas.DataFrame
+            The listing table the positions refer to.
+        """
+        self.size = len(data)
+        self.sorted = {}
+        self.bitmaps = {}
+
+        for col in RANGE_COLUMNS:
+            if col in data.columns:
+                values = pd.to_numeric(data[col], errors='coerce').to_numpy(dtype=float)
+                order = np.argsort(values, kind='stable')  # NaN sorts last
+                valid = np.count_nonzero(~np.isnan(values))
+                self.sorted[col] = (values[order[:valid]], order[:valid])
+
+        for col in CATEGORY_COLUMNS:
+            if col in data.columns:
+                codes, uniques = pd.factorize(data[col])  # NaN gets code -1
+                self.bitmaps[col] = {
+                    value: np.packbits(codes == code)
+                    for code, value in enumerate(uniques)
+                }
+
+    def values(self, col):
+        """Sorted distinct values of a category column, empty if it is missing."""
+        return sorted(self.bitmaps.get(col, {}))
+
+    def _range_bitmap(self, col, low=None, high=None):
+        values, order = self.sorted[col]
+        start = 0 if low is None else np.searchsorted(values, low, side='left')
+        stop = len(values) if high is None else np.searchsorted(values, high, side='right')
+        mask = np.zeros(self.size, dtype=bool)
+        mask[order[start:stop]] = True
+        return np.packbits(mask)
+
+    def _category_bitmap(self, col, value):
+        bitmap = self.bitmaps[col].get(value)
+        if bitmap is None:
+            # Unknown values match nothing, like an equality filter would
+            return np.zeros((self.size + 7) // 8, dtype=np.uint8)
+        return bitmap
+
+    def search(self, min_rating=None, max_price=None, property_type=None, bedrooms=None, within=None):
+        """
+        Find the listings matching the Buyer Page filters.
+
+        Filters left as None, or on columns missing from the snapshot, are
+        skipped, as is a `property_type` of "Any". `within` restricts
+        the search to given row positions, e.g. a `SpatialIndex` query.
+
+        Returns
+        -------
+        numpy.ndarray
+            Row positions of the matching listings, in table order.
+        """
+        bitmaps = []
+        if min_rating is not None and 'review_scores_rating' in self.sorted:
+            bitmaps.append(self._range_bitmap('review_scores_rating', low=min_rating))
+        if property_type not in (None, "Any") and 'property_type' in self.bitmaps:
+            bitmaps.append(self._category_bitmap('property_type', property_type))
+        if max_price is not None and 'price' in self.sorted:
+            bitmaps.append(self._range_bitmap('price', high=max_price))
+        if bedrooms is not None and 'bedrooms' in self.bitmaps:
+            bitmaps.append(self._category_bitmap('bedrooms', bedrooms))
+        if within is not None:
+            mask = np.zeros(self.size, dtype=bool)
+            mask[within] = True
+            bitmaps.append(np.packbits(mask))
+
+        if not bitmaps:
+            return np.arange(self.size)
+        result = bitmaps[0]
+        for bitmap in bitmaps[1:]:
+            result = np.bitwise_and(result, bitmap)
+        return np.flatnonzero(np.unpackbits(result, count=self.size))
+
+    def sort(self, positions, col, ascending=True):
+        """
+        Reorder `positions` by a range column through its presorted order.
+
+        No sort runs at query time: the column order built with the index
+        is filtered down to `positions`. Listings missing the value go last.
+        """
+        values, order = self.sorted[col]
+        mask = np.zeros(self.size, dtype=bool)
+        mask[positions] = True
+        ranked = order[mask[order]]
+        if not ascending:
+            ranked = ranked[::-1]
+        mask[ranked] = False
+        return np.concatenate([ranked, np.flatnonzero(mask)])
+
+
+class QueryCache(object):
+    def __init__(self, max_bytes=QUERY_CACHE_BYTES, name='search_results'):
+        """
+        Least-recently-used cache of `ListingIndex.search` results.
+
+        Keys are the normalized filters plus the snapshot version, so the
+        same search from any session is answered from the cache, and
+        results of an older snapshot are dropped as soon as a newer one is
+        searched. Values are read-only row position arrays, narrowed to
+        int32, never DataFrames.
+
+        Parameters
+        ----------
+        max_bytes : int, optional
+            Memory budget of the cached positions.
+        name : str, optional
+            Name its hit and miss counts are reported under in `utils.metrics`.
+        """
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+        register_cache(name, self.info)
+
+    @staticmethod
+    def key(**criteria):
+        """Filters in a canonical form: skipped filters dropped, numbers as floats."""
+        normalized = []
+        for name, value in sorted(criteria.items()):
+            if value is None or (name == 'property_type' and value == "Any"):
+                continue
+            if isinstance(value, (int, float, np.number)) and not isinstance(value, bool):
+                value = float(value)
+            normalized.append((name, value))
+        return tuple(normalized)
+
+    def search(self, index, version, source=None, **criteria):
+        """
+        `index.search(**criteria)` through the cache.
+
+        Parameters
+        ----------
+        index : ListingIndex
+            Index of the snapshot `version`.
+        version : str
+            Version of the snapshot searched.
+        source : str, optional
+            Listing file the snapshot came from, when results of several
+            files (e.g. cities) share the cache; a new version of a source
+            drops the results of its older versions.
+        """
+        key = (source, version, self.key(**criteria))
+        with self._lock:
+            positions = self._entries.get(key)
+            if positions is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return positions
+            self.misses += 1
+
+        positions = index.search(**criteria)
+        if index.size <= np.iinfo(np.int32).max:
+            positions = positions.astype(np.int32)
+        positions.setflags(write=False)
+
+        with self._lock:
+            if self._versions.get(source) != version:
+                self._discard(source)
+                self._versions[source] = version
+            if key not in self._entries:
+                self._entries[key] = positions
+                self.nbytes += positions.nbytes
+            while self.nbytes > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+        return positions
+
+    def _discard(self, source):
+        for key in [k for k in self._entries if k[0] == source]:
+            self.nbytes -= self._entries.pop(key).nbytes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+            self.nbytes = 0
+
+    def info(self):
+        """Hit and miss counts and current size, like `functools.lru_cache`'s `cache_info()`."""
+        with self._lock:
+            return QueryCacheInfo(self.hits, self.misses, len(self._entries), self.nbytes, self.max_bytes)
@@ -0,0 +1,169 @@
+import os
+import pickle
+import hashlib
+import threading
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from utils.metrics import cache_hit, register_cache
+
+CACHE_DIR = os.getenv('AIRBNB_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'airbnb'))
+
+# Content hash -> compound score of every text scored so far
+CACHE_PATH = os.path.join(CACHE_DIR, 'sentiment_cache.pickle')
+
+# Sentiment features and the text column each one is scored from
+SENTIMENT_SOURCES = {
+    'neighborhood_sentiment': 'neighborhood_overview',
+    'host_neighbourhood_sentiment': 'host_neighbourhood',
+    'amenities_sentiment': 'amenities',
+}
+
+# Below this many new texts, scoring inline beats starting a process pool
+CHUNK_SIZE = 2000
+
+# Distinct texts remembered by the in-process score cache
+LRU_SIZE = 4096
+
+_analyzer = None
+_analyzer_lock = threading.Lock()
+_worker_analyzer = None
+
+
+def get_analyzer():
+    """The process-wide SentimentIntensityAnalyzer, the lexicon is only loaded once."""
+    global _analyzer
+    if _analyzer is None:
+        with _analyzer_lock:
+            if _analyzer is None:
+                from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+                _analyzer = SentimentIntensityAnalyzer()
+    return _analyzer
+
+
+@lru_cache(maxsize=LRU_SIZE)
+def cached_compound(text):
+    """Compound score of `text`, memoized across reruns and sessions."""
+    return get_analyzer().polarity_scores(text)['compound']
+
+
+register_cache('sentiment_lru', cached_compound.cache_info)
+
+
+def sentiment_cache_info():
+    """Hit/miss counters and size of the in-process score cache."""
+    return cached_compound.cache_info()
+
+
+def _init_worker():
+    global _worker_analyzer
+    from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+    _worker_analyzer = SentimentIntensityAnalyzer()
+
+
+def _score_chunk(texts):
+    return [_worker_analyzer.polarity_scores(text)['compound'] for text in texts]
+
+
+def text_key(text):
+    """Content hash used as the key of the on-disk score cache."""
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+
+
+def load_cache(cache_path=CACHE_PATH):
+    if cache_path and os.path.exists(cache_path):
+        with open(cache_path, 'rb') as f:
+            return pickle.load(f)
+    return {}
+
+
+def save_cache(cache, cache_path=CACHE_PATH):
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(cache, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, cache_path)
+
+
+def score_texts(texts, cache_path=CACHE_PATH, processes=None, chunksize=CHUNK_SIZE):
+    """
+    VADER compound scores for a collection of texts.
+
+    Each distinct text is scored once. Texts already in the on-disk cache
+    are not scored again, and the rest are split into chunks scored across
+    a process pool.
+
+    Parameters
+    ----------
+    texts : iterable of str
+        Texts to score, duplicates are fine.
+    cache_path : str, optional
+        Location of the content-hash cache, `None` disables it.
+    processes : int, optional
+        Pool size, defaults to the number of CPUs.
+    chunksize : int, optional
+        Number of texts sent to a worker at a time.
+
+    Returns
+    -------
+    dict
+        Mapping of each distinct text to its compound score.
+    """
+    unique = set(texts)
+    cache = load_cache(cache_path) if cache_path else {}
+
+    scores = {}
+    pending = []
+    for text in unique:
+        score = cache.get(text_key(text))
+        if score is None:
+            pending.append(text)
+        else:
+            scores[text] = score
+
+    if cache_path:
+        cache_hit('sentiment_disk', True, len(scores))
+        cache_hit('sentiment_disk', False, len(pending))
+
+    if pending:
+        chunks = [pending[i:i + chunksize] for i in range(0, len(pending), chunksize)]
+        if len(chunks) == 1 or processes == 1:
+            _init_worker()
+            results = map(_score_chunk, chunks)
+            new_scores = [score for chunk in results for score in chunk]
+        else:
+            with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker) as pool:
+                new_scores = [score for chunk in pool.map(_score_chunk, chunks) for score in chunk]
+
+        for text, score in zip(pending, new_scores):
+            scores[text] = score
+            cache[text_key(text)] = score
+        if cache_path:
+            save_cache(cache, cache_path)
+
+    print(f"Sentiment: {len(unique)} distinct texts, {len(pending)} newly scored")
+    return scores
+
+
+def add_sentiment_features(data, sources=SENTIMENT_SOURCES, **kwargs):
+    """
+    Add a compound score column for each text column in `sources`.
+
+    Texts from all columns are pooled so repeats across columns are scored
+    once. Missing and non-string values score 0. Extra keyword arguments go
+    to `score_texts`.
+    """
+    sources = {f: src for f, src in sources.items() if src in data.columns}
+    if not sources:
+        return data
+
+    texts = pd.concat([data[src] for src in sources.values()], ignore_index=True)
+    texts = [text for text in texts.unique() if isinstance(text, str)]
+    scores = score_texts(texts, **kwargs) if texts else {}
+
+    data = data.copy()
+    for feature, src in sources.items():
+        data[feature] = data[src].map(scores).fillna(0).astype(float)
+    return data
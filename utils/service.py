@@ -0,0 +1,303 @@
+import os
+import sys
+import json
+import math
+import argparse
+import threading
+from contextlib import asynccontextmanager
+
+# Add the parent directory to Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pandas as pd
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+from utils import metrics
+from utils.batch_predict import PROPERTY_TYPE_PREFIX, BatchScorer
+from utils.model_registry import ModelRegistry
+from utils.modeling_sentiment import get_b2, load_model
+from utils.results import DISPLAY_COLUMNS, ResultCursor
+from utils.search import ListingIndex, QueryCache
+from utils.sentiment import SENTIMENT_SOURCES, cached_compound
+from utils.snapshot import SnapshotRefresher
+
+# Columns returned for every search result
+RESULT_COLUMNS = ['id'] + DISPLAY_COLUMNS + ['property_type', 'latitude', 'longitude']
+
+# Upper bound on the listings returned by one /search call
+MAX_LIMIT = 1000
+
+
+class ServiceState(object):
+    def __init__(self, refresher, registry=None):
+        """
+        Listing snapshot, search index and scorer shared by every request.
+
+        The snapshot is read-only, so requests use it concurrently without
+        locking. The refresher builds the index of every new snapshot in
+        the background and swaps both in together. Scorers are built once
+        per model version and swapped when the registry's active version
+        changes. Search results are cached by filters and snapshot
+        version across requests.
+
+        Parameters
+        ----------
+        refresher : utils.snapshot.SnapshotRefresher
+            Source of the listings to search, started, with a `prepare`
+            that returns the snapshot's ListingIndex.
+        registry : utils.model_registry.ModelRegistry, optional
+            Source of the active model version.
+        """
+        self.refresher = refresher
+        self.registry = registry or ModelRegistry()
+        self.results = QueryCache()
+        self._scorers = {}
+        self._lock = threading.Lock()
+
+    def scorer(self):
+        """The BatchScorer of the active model version."""
+        version = self.registry.current_version()
+        scorer = self._scorers.get(version)
+        if scorer is None:
+            with self._lock:
+                if version not in self._scorers:
+                    self._scorers = {version: BatchScorer(*load_model(version))}
+                scorer = self._scorers[version]
+        return scorer, version
+
+    @property
+    def listings(self):
+        """`(snapshot, index)`, read together so a request never mixes two snapshots."""
+        return self.refresher.state
+
+
+def listing_refresher(data_path=None):
+    """Refresher of the listings in a local file, or in B2 as the app loads them."""
+    def prepare(snapshot):
+        return ListingIndex(snapshot.data)
+    if data_path:
+        return SnapshotRefresher(None, data_path, prepare=prepare)
+    # Connects on the first check, a snapshot already on disk is served without Backblaze
+    return SnapshotRefresher(get_b2, os.getenv('LISTINGS_FILE', 'Cleaned_Austin_AirBnB.xlsx'), prepare=prepare)
+
+
+def _check_numbers(listings, features):
+    # null or text in a numeric field would make the prediction NaN
+    for i, listing in enumerate(listings):
+        for feature in features.intersection(listing):
+            value = listing[feature]
+            try:
+                number = float(value) if not isinstance(value, bool) else None
+            except (TypeError, ValueError):
+                number = None
+            if number is None or not math.isfinite(number):
+                raise ValueError(f"Listing {i}: '{feature}' must be a number")
+
+
+def _check_strings(listings, fields):
+    # Text fields are tokenized or scored for sentiment, null counts as missing
+    for i, listing in enumerate(listings):
+        for field in fields.intersection(listing):
+            if listing[field] is not None and not isinstance(listing[field], str):
+                raise ValueError(f"Listing {i}: '{field}' must be a string")
+
+
+@metrics.timed('service_predict')
+def predict_listings(state, listings):
+    """Score a list of listing dicts, adding any missing sentiment features from their text."""
+    scorer, version = state.scorer()
+    _check_numbers(listings, {f for f in scorer.feature_index if not f.startswith(PROPERTY_TYPE_PREFIX)})
+    _check_strings(listings, {'property_type', 'amenities'} | set(SENTIMENT_SOURCES.values()))
+    df = pd.DataFrame(listings)
+    for feature, source in scorer.sentiment_sources().items():
+        if feature not in df.columns:
+            texts = df[source] if source in df.columns else [None] * len(df)
+            # Same as the Seller Page: missing text scores 0
+            df[feature] = [cached_compound(t) if isinstance(t, str) and t else 0 for t in texts]
+    return scorer.predict(df), version
+
+
+def _number(params, name, cast=float):
+    value = params.get(name)
+    if value in (None, ''):
+        return None
+    try:
+        number = float(value)
+        if cast is int:
+            # 2 and 2.0 are the same bedroom count, 2.5 is not
+            if not number.is_integer():
+                raise ValueError
+            return int(number)
+        return cast(number)
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError(f"'{name}' must be a number")
+
+
+@metrics.timed('service_search')
+def search_listings(state, params):
+    """
+    Run the Buyer Page filters over the shared index.
+
+    Returns
+    -------
+    tuple
+        `(summary, page)`: a dict with the `total` number of matches, and
+        the DataFrame page selected with `offset`, `limit`, `sort_by` and
+        `ascending`.
+    """
+    for name in ('property_type', 'sort_by'):
+        if params.get(name) is not None and not isinstance(params[name], str):
+            raise ValueError(f"'{name}' must be a string")
+
+    snapshot, index = state.listings
+    data = snapshot.data
+    matches = state.results.search(
+        index, snapshot.version,
+        min_rating=_number(params, 'min_rating'),
+        max_price=_number(params, 'max_price'),
+        property_type=params.get('property_type'),
+        bedrooms=_number(params, 'bedrooms', int),
+    )
+
+    offset = _number(params, 'offset', int) or 0
+    if offset < 0:
+        raise ValueError("'offset' must not be negative")
+    limit = _number(params, 'limit', int)
+    if limit is not None and limit < 0:
+        raise ValueError("'limit' must not be negative")
+    limit = min(50 if limit is None else limit, MAX_LIMIT)
+    sort_by = params.get('sort_by')
+    if sort_by is not None and sort_by not in data.columns:
+        raise ValueError(f"Cannot sort by '{sort_by}'")
+    ascending = str(params.get('ascending', 'true')).lower() not in ('0', 'false', 'no')
+
+    cursor = ResultCursor(matches, snapshot.version)
+    rows = cursor.ordered(data, index, sort_by, ascending)[offset:offset + limit]
+    page = data.iloc[rows][[c for c in RESULT_COLUMNS if c in data.columns]]
+    summary = {'snapshot': snapshot.version, 'total': len(cursor), 'offset': offset}
+    return summary, page
+
+
+def _error(message, status_code=400):
+    return JSONResponse({'error': message}, status_code=status_code)
+
+
+async def health(request):
+    state = request.app.state.service
+    snapshot, index = state.listings
+    return JSONResponse({
+        'snapshot': snapshot.version,
+        'rows': index.size,
+        'model': state.registry.current_version(),
+    })
+
+
+async def predict(request):
+    """
+    Predict review scores.
+
+    The body is one listing object, a list of them, or `{"listings": [...]}`.
+    Listings carry the Seller Page fields; raw text fields are scored for
+    sentiment unless the sentiment features are given.
+    """
+    try:
+        body = await request.json()
+    except ValueError:
+        return _error("Request body must be JSON")
+    single = isinstance(body, dict) and 'listings' not in body
+    listings = [body] if single else body.get('listings') if isinstance(body, dict) else body
+    if not isinstance(listings, list) or not all(isinstance(l, dict) for l in listings):
+        return _error("Expected a listing object or a list of them")
+    if not listings:
+        return JSONResponse({'predictions': [], 'model': request.app.state.service.registry.current_version()})
+
+    # Scoring is CPU-bound, keep it off the event loop
+    try:
+        predictions, version = await run_in_threadpool(predict_listings, request.app.state.service, listings)
+    except ValueError as e:
+        return _error(str(e))
+    if single:
+        return JSONResponse({'predicted_review_score': float(predictions[0]), 'model': version})
+    return JSONResponse({'predictions': predictions.tolist(), 'model': version})
+
+
+async def search(request):
+    """Buyer Page search; filters come from the query string or a JSON body."""
+    params = dict(request.query_params)
+    if request.method == 'POST':
+        try:
+            body = await request.json()
+        except ValueError:
+            return _error("Request body must be JSON")
+        if not isinstance(body, dict):
+            return _error("Request body must be a JSON object")
+        params.update(body)
+    try:
+        summary, page = await run_in_threadpool(search_listings, request.app.state.service, params)
+    except ValueError as e:
+        return _error(str(e))
+    # The page is serialized by pandas straight into the response body
+    body = json.dumps(summary)[:-1] + ', "results": ' + page.to_json(orient='records') + '}'
+    return Response(body, media_type='application/json')
+
+
+async def prometheus(request):
+    return Response(metrics.prometheus_text(), media_type='text/plain; version=0.0.4')
+
+
+def create_app(data_path=None, registry=None):
+    """
+    Build the ASGI app.
+
+    Parameters
+    ----------
+    data_path : str, optional
+        Local Excel/CSV/Parquet listing file; defaults to `LISTINGS_PATH`,
+        and to `LISTINGS_FILE` in the B2 bucket when neither is set. It is
+        checked for changes every `AIRBNB_REFRESH_SECONDS`.
+    registry : utils.model_registry.ModelRegistry, optional
+        Model registry to score with.
+    """
+    data_path = data_path or os.getenv('LISTINGS_PATH')
+
+    @asynccontextmanager
+    async def lifespan(app):
+        # Available before the first request is accepted, then refreshed in the background
+        refresher = await run_in_threadpool(lambda: listing_refresher(data_path).start())
+        app.state.service = ServiceState(refresher, registry)
+        app.state.service.scorer()
+        snapshot, index = refresher.state
+        print(f"Serving {index.size} listings from snapshot {snapshot.version}")
+        yield
+        refresher.stop()
+
+    return Starlette(
+        routes=[
+            Route('/health', health),
+            Route('/metrics', prometheus),
+            Route('/predict', predict, methods=['POST']),
+            Route('/search', search, methods=['GET', 'POST']),
+        ],
+        lifespan=lifespan,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve review score predictions and listing search over HTTP.")
+    parser.add_argument('--data', help="Local listing file to serve instead of the B2 bucket")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=1)
+    args = parser.parse_args()
+
+    import uvicorn
+    if args.data:
+        os.environ['LISTINGS_PATH'] = args.data
+    if args.workers > 1:
+        # Workers import the app themselves; the snapshot file is memory-mapped and shared
+        uvicorn.run('utils.service:create_app', factory=True, host=args.host, port=args.port, workers=args.workers)
+    else:
+        uvicorn.run(create_app(), host=args.host, port=args.port)
@@ -0,0 +1,277 @@
+import os
+import sys
+import argparse
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# Add the parent directory to Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import numpy as np
+import pandas as pd
+
+from utils.metrics import cache_hit, timed
+from utils.search import ListingIndex
+from utils.snapshot import load_snapshot
+
+# Per-city listing files live under this folder of the bucket, as
+# `cities/<city>.csv` or `cities/<city>/<file>.csv`
+SHARD_PREFIX = os.getenv('LISTINGS_PREFIX', 'cities/')
+
+SHARD_EXTENSIONS = ('.xlsx', '.xls', '.csv', '.parquet')
+
+# Upper bound on the memory of the shards kept loaded at once
+SHARD_MEMORY = int(os.getenv('AIRBNB_SHARD_MEMORY_MB', '1024')) * 1024 * 1024
+
+# Shards filtered or aggregated at the same time
+MAX_WORKERS = 8
+
+
+def discover_shards(keys, prefix=SHARD_PREFIX):
+    """
+    Mapping of city -> object key of the listing files under `prefix`.
+
+    When a city folder holds several files, the last one by name (e.g. the
+    newest of dated exports) is used.
+    """
+    shards = {}
+    for key in sorted(keys):
+        if not key.startswith(prefix) or os.path.splitext(key)[1].lower() not in SHARD_EXTENSIONS:
+            continue
+        name = key[len(prefix):]
+        city = name.split('/', 1)[0] if '/' in name else os.path.splitext(name)[0]
+        if city:
+            shards[city] = key
+    return shards
+
+
+class Shard(object):
+    def __init__(self, city, key, snapshot):
+        """
+        One city's listings, loaded through the snapshot cache.
+
+        Parameters
+        ----------
+        city : str
+            Name of the city partition.
+        key : str
+            Object key of its listing file.
+        snapshot : utils.snapshot.Snapshot
+            Its memory-mapped listing table.
+        """
+        self.city = city
+        self.key = key
+        self.snapshot = snapshot
+        self.nbytes = int(snapshot.data.memory_usage(deep=True).sum())
+        self._derived = {}
+
+    def derived(self, name, build):
+        """
+        A structure derived from the shard's listings, built with `build()` on first use.
+
+        It lives as long as the shard, so evicting the shard also releases
+        its indexes, grids and other per-snapshot structures.
+        """
+        value = self._derived.get(name)
+        if value is None:
+            value = self._derived[name] = build()
+        return value
+
+    @property
+    def index(self):
+        """The shard's ListingIndex, built on first use."""
+        return self.derived('listing_index', lambda: ListingIndex(self.snapshot.data))
+
+
+class ShardCatalog(object):
+    def __init__(self, b2, prefix=SHARD_PREFIX, max_bytes=SHARD_MEMORY, max_workers=MAX_WORKERS, cache_dir=None):
+        """
+        Per-city listing shards discovered in the bucket and loaded on demand.
+
+        Only the cities a query touches are loaded. Loaded shards are kept
+        in least-recently-used order and the oldest are dropped once their
+        total size exceeds `max_bytes`, so memory follows the active cities
+        rather than the whole catalogue. Queries over several cities run on
+        a thread pool, one shard per task.
+
+        Parameters
+        ----------
+        b2 : utils.b2.B2
+            Connection with the bucket already selected.
+        prefix : str, optional
+            Folder of the city partitions in the bucket.
+        max_bytes : int, optional
+            Memory budget of the loaded shards; the most recently used shard
+            is always kept, even when it alone is larger.
+        max_workers : int, optional
+            Shards processed in parallel.
+        cache_dir : str, optional
+            Snapshot cache directory, see `utils.snapshot.load_snapshot`.
+        """
+        self.b2 = b2
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.max_workers = max_workers
+        self.cache_dir = cache_dir
+        self._loaded = OrderedDict()
+        self._lock = threading.Lock()
+        self._loading = {}
+        self.refresh()
+
+    def refresh(self):
+        """List the bucket again to pick up added or removed cities."""
+        self.shards = discover_shards(self.b2.list_files(), self.prefix)
+        return self.cities()
+
+    def cities(self):
+        return sorted(self.shards)
+
+    @property
+    def nbytes(self):
+        """Memory of the shards currently loaded."""
+        with self._lock:
+            return sum(shard.nbytes for shard in self._loaded.values())
+
+    def loaded(self):
+        """Cities currently loaded, least recently used first."""
+        with self._lock:
+            return list(self._loaded)
+
+    def shard(self, city):
+        """The loaded Shard of `city`, loading it (and evicting others) if needed."""
+        if city not in self.shards:
+            raise KeyError(f"Unknown city '{city}'")
+        with self._lock:
+            shard = self._loaded.get(city)
+            if shard is not None:
+                self._loaded.move_to_end(city)
+                cache_hit('shards', True)
+                return shard
+            # One load per city, concurrent requests for it wait on the same lock
+            loading = self._loading.setdefault(city, threading.Lock())
+
+        with loading:
+            with self._lock:
+                shard = self._loaded.get(city)
+            if shard is None:
+                cache_hit('shards', False)
+                shard = self._load(city)
+                with self._lock:
+                    self._loaded[city] = shard
+                    self._evict()
+        with self._lock:
+            self._loading.pop(city, None)
+        return shard
+
+    @timed('shard_load')
+    def _load(self, city):
+        key = self.shards[city]
+        return Shard(city, key, load_snapshot(self.b2, key, self.cache_dir))
+
+    def _evict(self):
+        # Callers still holding an evicted shard keep it alive until they are done
+        total = sum(shard.nbytes for shard in self._loaded.values())
+        while total > self.max_bytes and len(self._loaded) > 1:
+            city, shard = self._loaded.popitem(last=False)
+            total -= shard.nbytes
+            print(f"Evicted shard {city} ({shard.nbytes / 2**20:.1f} MiB)")
+
+    def map(self, fn, cities=None):
+        """
+        Apply `fn(shard)` to the shard of every city, in parallel.
+
+        Returns
+        -------
+        dict
+            city -> result, in the order of `cities` (all cities by default).
+        """
+        cities = self.cities() if cities is None else list(cities)
+        if len(cities) <= 1:
+            return {city: fn(self.shard(city)) for city in cities}
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(cities))) as pool:
+            results = pool.map(lambda city: fn(self.shard(city)), cities)
+            return dict(zip(cities, results))
+
+    @timed('shard_search')
+    def search(self, cities=None, **criteria):
+        """Buyer Page filters over several cities: city -> matching row positions of its shard."""
+        return self.map(lambda shard: shard.index.search(**criteria), cities)
+
+    def rows(self, matches, columns=None):
+        """The listings of a `search` result as one DataFrame with a `city` column."""
+        frames = []
+        for city, positions in matches.items():
+            data = self.shard(city).snapshot.data
+            frame = data.iloc[positions]
+            if columns is not None:
+                frame = frame[[c for c in columns if c in frame.columns]]
+            frames.append(frame.assign(city=city))
+        if not frames:
+            return pd.DataFrame(columns=['city'] + list(columns or []))
+        return pd.concat(frames, ignore_index=True)
+
+    @timed('shard_aggregate')
+    def aggregate(self, cities=None, by=None):
+        """
+        Listing count, mean rating and mean price per city (and `by` column).
+
+        Every shard is reduced to sums on its own, in parallel, and the
+        sums are combined into means afterwards.
+        """
+        keys = ['city'] + ([by] if by else [])
+
+        def sums(shard):
+            data = shard.snapshot.data
+            rating = pd.to_numeric(data.get('review_scores_rating'), errors='coerce')
+            price = pd.to_numeric(data.get('price'), errors='coerce')
+            frame = pd.DataFrame({
+                'city': shard.city,
+                'listings': np.ones(len(data), dtype=np.int64),
+                'rating_count': rating.notna().to_numpy(dtype=np.int64),
+                'rating_sum': rating.fillna(0).to_numpy(dtype=float),
+                'price_count': price.notna().to_numpy(dtype=np.int64),
+                'price_sum': price.fillna(0).to_numpy(dtype=float),
+            })
+            if by:
+                frame[by] = data[by].to_numpy() if by in data.columns else None
+            return frame.groupby(keys, observed=True, dropna=False).sum()
+
+        partial = list(self.map(sums, cities).values())
+        if not partial:
+            return pd.DataFrame(columns=keys + ['listings', 'avg_rating', 'avg_price'])
+        totals = pd.concat(partial).groupby(level=keys, dropna=False).sum()
+        return pd.DataFrame({
+            'listings': totals['listings'],
+            'avg_rating': totals['rating_sum'] / totals['rating_count'].where(totals['rating_count'] > 0),
+            'avg_price': totals['price_sum'] / totals['price_count'].where(totals['price_count'] > 0),
+        }).reset_index()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect and query the per-city listing shards in the bucket.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('list', help="Show the discovered cities and their files")
+    search_parser = sub.add_parser('search', help="Count matching listings per city")
+    search_parser.add_argument('cities', nargs='*', help="Cities to search, all by default")
+    search_parser.add_argument('--min-rating', type=float)
+    search_parser.add_argument('--max-price', type=float)
+    search_parser.add_argument('--property-type')
+    search_parser.add_argument('--bedrooms', type=int)
+    summary_parser = sub.add_parser('summary', help="Listings, mean rating and price per city")
+    summary_parser.add_argument('cities', nargs='*', help="Cities to summarize, all by default")
+    summary_parser.add_argument('--by', help="Also group by this column, e.g. property_type")
+    args = parser.parse_args()
+
+    from utils.modeling_sentiment import get_b2
+    catalog = ShardCatalog(get_b2())
+    if args.command == 'list':
+        for city in catalog.cities():
+            print(f"{city:24s} {catalog.shards[city]}")
+    elif args.command == 'search':
+        matches = catalog.search(args.cities or None, min_rating=args.min_rating, max_price=args.max_price,
+                                 property_type=args.property_type, bedrooms=args.bedrooms)
+        for city, positions in matches.items():
+            print(f"{city:24s} {len(positions)}")
+    else:
+        print(catalog.aggregate(args.cities or None, by=args.by).to_string(index=False))
@@ -0,0 +1,360 @@
+import os
+import glob
+import json
+import hashlib
+import threading
+from io import BytesIO
+
+import pandas as pd
+import pyarrow as pa
+
+from utils.ingest import APP_COLUMNS, STREAMING_EXTENSIONS, ingest_to_snapshot
+from utils.metrics import cache_hit, timer
+
+# Local directory holding the columnar copies of remote listing files
+CACHE_DIR = os.getenv('AIRBNB_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'airbnb'))
+
+SNAPSHOT_SUFFIX = '.arrow'
+
+# Seconds between checks of the source file by SnapshotRefresher, 0 turns the checks off
+REFRESH_INTERVAL = float(os.getenv('AIRBNB_REFRESH_SECONDS', '300'))
+
+# Schema metadata key holding the version of the source file a snapshot was converted from
+VERSION_KEY = b'source_version'
+
+
+class Snapshot(object):
+    def __init__(self, version, data, path=None):
+        """
+        A read-only, memory-mapped copy of a remote listing file.
+
+        Parameters
+        ----------
+        version : str
+            The ETag (or last-modified time) of the remote object the
+            snapshot was converted from.
+        data : pandas.DataFrame
+            The listing table. Numeric columns share pages with the
+            on-disk snapshot, so it must not be modified in place.
+        path : str, optional
+            Location of the snapshot file on disk.
+        """
+        self.version = version
+        self.data = data
+        self.path = path
+
+
+def snapshot_version(meta):
+    """Derive a snapshot version from a B2 HEAD response."""
+    etag = meta.get('ETag')
+    if etag:
+        return etag.strip('"')
+    return str(meta['LastModified'].timestamp())
+
+
+def _snapshot_prefix(cache_dir, remote_path, columns=None):
+    name = remote_path.replace('/', '_').replace('\\', '_')
+    if columns is not None:
+        # Different column selections of one file are separate snapshots
+        name += '.' + hashlib.sha1(','.join(columns).encode('utf-8')).hexdigest()[:8]
+    return os.path.join(cache_dir, name)
+
+
+def _snapshot_path(cache_dir, remote_path, version, columns=None):
+    digest = hashlib.sha1(version.encode('utf-8')).hexdigest()[:16]
+    return f"{_snapshot_prefix(cache_dir, remote_path, columns)}-{digest}{SNAPSHOT_SUFFIX}"
+
+
+def _local_snapshots(cache_dir, remote_path, columns=None):
+    """Snapshots already converted for `remote_path`, newest first."""
+    paths = glob.glob(f"{glob.escape(_snapshot_prefix(cache_dir, remote_path, columns))}-*{SNAPSHOT_SUFFIX}")
+    return sorted(paths, key=os.path.getmtime, reverse=True)
+
+
+def _snapshot_columns(path, columns=None):
+    # CSV/Parquet files keep only `columns` (the app's by default), Excel files are converted whole
+    if os.path.splitext(path)[1].lower() in STREAMING_EXTENSIONS:
+        return columns or APP_COLUMNS
+    return None
+
+
+def latest_local_snapshot(remote_path, cache_dir=None, columns=None):
+    """The newest snapshot already converted for `remote_path`, without contacting Backblaze, or None."""
+    cache_dir = cache_dir or CACHE_DIR
+    local = _local_snapshots(cache_dir, remote_path, _snapshot_columns(remote_path, columns))
+    if not local:
+        return None
+    # Snapshots written before the version was stored fall back to their file name
+    version = read_snapshot_version(local[0]) or os.path.basename(local[0])
+    return Snapshot(version, read_snapshot(local[0]), local[0])
+
+
+def local_version(file_path):
+    """Version of a local listing file, from its modification time and size."""
+    stat = os.stat(file_path)
+    return f"{stat.st_mtime_ns}-{stat.st_size}"
+
+
+def read_source(file_content, remote_path):
+    """Parse the raw bytes of a remote listing file based on its extension."""
+    ext = os.path.splitext(remote_path)[1].lower()
+    if ext in ('.xlsx', '.xls'):
+        return pd.read_excel(BytesIO(file_content))
+    if ext == '.csv':
+        return pd.read_csv(BytesIO(file_content))
+    if ext == '.parquet':
+        return pd.read_parquet(BytesIO(file_content))
+    raise ValueError(f"Unsupported listing file type: {remote_path}")
+
+
+def _to_arrow(df):
+    """Convert `df` to an Arrow table, stringifying mixed-type object columns."""
+    try:
+        return pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        df = df.copy()
+        for col in df.columns[df.dtypes == object]:
+            if pd.api.types.infer_dtype(df[col], skipna=True) not in ('string', 'empty'):
+                df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+        return pa.Table.from_pandas(df, preserve_index=False)
+
+
+def write_snapshot(df, path, version=None):
+    """Atomically write `df` to `path` as an uncompressed Arrow IPC file, recording the source `version`."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    table = _to_arrow(df)
+    if version is not None:
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), VERSION_KEY: version.encode('utf-8')})
+    with pa.OSFile(tmp_path, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+
+
+def read_snapshot(path):
+    """Memory-map a snapshot file and expose it as a DataFrame."""
+    source = pa.memory_map(path, 'r')
+    table = pa.ipc.open_file(source).read_all()
+    metadata = table.schema.metadata or {}
+    categories = json.loads(metadata.get(b'categories', b'[]'))
+    # split_blocks lets null-free numeric columns point straight at the mapping
+    return table.to_pandas(split_blocks=True, categories=categories)
+
+
+def read_snapshot_version(path):
+    """Version of the source file a snapshot was converted from, or None if it was not recorded."""
+    with pa.memory_map(path, 'r') as source:
+        metadata = pa.ipc.open_file(source).schema.metadata or {}
+    version = metadata.get(VERSION_KEY)
+    return version.decode('utf-8') if version is not None else None
+
+
+def load_snapshot(b2, remote_path, cache_dir=None, columns=None):
+    """
+    Load `remote_path` from the selected bucket through the local snapshot cache.
+
+    The remote file is only downloaded and converted when its ETag changes;
+    otherwise the existing snapshot is memory-mapped. If Backblaze cannot be
+    reached, the newest local snapshot for `remote_path` is served instead.
+
+    CSV and Parquet files are streamed into the snapshot in chunks, keeping
+    only `columns` (the ones the app uses by default) with narrow dtypes,
+    so they never have to fit in memory. Excel files are converted whole.
+
+    Parameters
+    ----------
+    b2 : utils.b2.B2
+        Connection with the bucket already selected.
+    remote_path : str
+        Name of the listing file in the bucket.
+    cache_dir : str, optional
+        Directory holding snapshots, defaults to `CACHE_DIR`.
+    columns : list of str, optional
+        Columns kept when streaming, defaults to `APP_COLUMNS`.
+
+    Returns
+    -------
+    Snapshot
+    """
+    cache_dir = cache_dir or CACHE_DIR
+    columns = _snapshot_columns(remote_path, columns)
+
+    try:
+        version = snapshot_version(b2.head(remote_path))
+    except Exception:
+        local = latest_local_snapshot(remote_path, cache_dir, columns)
+        if local is None:
+            raise
+        print(f"Backblaze unavailable, using local snapshot {local.path}")
+        return local
+
+    path = _snapshot_path(cache_dir, remote_path, version, columns)
+    cache_hit('snapshots', os.path.exists(path))
+    if not os.path.exists(path):
+        with timer('snapshot_convert'):
+            _build_snapshot(b2, remote_path, path, cache_dir, columns, version)
+    return Snapshot(version, read_snapshot(path), path)
+
+
+def _build_snapshot(b2, source_path, path, cache_dir, columns, version):
+    """Convert `source_path` (local when `b2` is None) at `version` to a snapshot at `path`."""
+    if columns is not None:
+        ingest_to_snapshot(b2, source_path, path, columns, metadata={VERSION_KEY: version.encode('utf-8')})
+    elif b2 is None:
+        with open(source_path, 'rb') as f:
+            write_snapshot(read_source(f.read(), source_path), path, version)
+    else:
+        file_content = b2.get_object(source_path).read()
+        write_snapshot(read_source(file_content, source_path), path, version)
+
+    # Older versions of the same file are no longer needed
+    for stale in _local_snapshots(cache_dir, source_path, columns):
+        if stale != path:
+            try:
+                os.remove(stale)
+            except OSError:
+                pass
+
+
+def load_local_snapshot(file_path, cache_dir=None, columns=None):
+    """
+    Load a listing file from the local filesystem through the snapshot cache.
+
+    Works like `load_snapshot` without Backblaze: the file's size and
+    modification time stand in for the ETag, so it is only converted again
+    after it changes.
+
+    Returns
+    -------
+    Snapshot
+    """
+    cache_dir = cache_dir or CACHE_DIR
+    columns = _snapshot_columns(file_path, columns)
+    version = local_version(file_path)
+    source_path = os.path.abspath(file_path)
+    path = _snapshot_path(cache_dir, source_path, version, columns)
+    cache_hit('snapshots', os.path.exists(path))
+    if not os.path.exists(path):
+        with timer('snapshot_convert'):
+            _build_snapshot(None, source_path, path, cache_dir, columns, version)
+    return Snapshot(version, read_snapshot(path), path)
+
+
+class SnapshotRefresher(object):
+    def __init__(self, b2, remote_path, interval=REFRESH_INTERVAL, cache_dir=None, columns=None, prepare=None):
+        """
+        Keeps a listing snapshot current from a background thread.
+
+        Readers take `current` (or `state`) and keep using that snapshot
+        for as long as they need it. A daemon thread checks the source's
+        version every `interval` seconds, a HEAD request for Backblaze,
+        and only when it changed downloads, converts and prepares the new
+        snapshot, then swaps it in with a single assignment. Readers never
+        wait on ingestion. They keep the old snapshot until their next
+        read, and a failed refresh leaves the old one in place.
+
+        Parameters
+        ----------
+        b2 : utils.b2.B2, callable or None
+            Connection with the bucket selected, a function returning
+            one, or None when `remote_path` is a local file. A function
+            is only called on the first check, so a snapshot already on
+            disk is served without connecting.
+        remote_path : str
+            Listing file to keep current.
+        interval : float, optional
+            Seconds between checks; 0 loads once and never checks again.
+        cache_dir : str, optional
+            Snapshot cache directory, defaults to `CACHE_DIR`.
+        columns : list of str, optional
+            Columns kept when streaming, see `load_snapshot`.
+        prepare : callable, optional
+            Called with each new snapshot in the background thread, e.g.
+            to build its search index; the result is swapped in with it.
+        """
+        self.b2 = None if callable(b2) else b2
+        self.remote = b2 is not None
+        self._connect = b2 if callable(b2) else None
+        self.remote_path = remote_path
+        self.interval = interval
+        self.cache_dir = cache_dir
+        self.columns = columns
+        self.prepare = prepare
+        self.state = None
+        self._version = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def current(self):
+        """The snapshot being served."""
+        return self.state[0] if self.state is not None else None
+
+    def _bucket(self):
+        if self.b2 is None and self._connect is not None:
+            self.b2 = self._connect()
+        return self.b2
+
+    def _source_version(self):
+        if not self.remote:
+            return local_version(self.remote_path)
+        return snapshot_version(self._bucket().head(self.remote_path))
+
+    def refresh(self):
+        """Check the source once and swap in a new snapshot if it changed; True when swapped."""
+        with self._lock:
+            version = self._source_version()
+            if version == self._version:
+                return False
+            with timer('snapshot_refresh'):
+                if not self.remote:
+                    snapshot = load_local_snapshot(self.remote_path, self.cache_dir, self.columns)
+                else:
+                    snapshot = load_snapshot(self._bucket(), self.remote_path, self.cache_dir, self.columns)
+                prepared = self.prepare(snapshot) if self.prepare is not None else None
+            # One assignment: readers see either the old pair or the new one
+            self.state = (snapshot, prepared)
+            self._version = version
+            return True
+
+    def _run(self, delay):
+        while not self._stop.wait(delay):
+            delay = self.interval
+            try:
+                if self.refresh():
+                    print(f"Swapped in snapshot {self.current.version} of {self.remote_path}")
+            except Exception as e:
+                print(f"Refreshing {self.remote_path} failed, still serving the previous snapshot: {e}")
+
+    def start(self):
+        """
+        Make a snapshot available, then keep it current in the background.
+
+        The newest snapshot already on disk is served straight away and
+        checked in the background; only when there is none does this load
+        one before returning. The check is a no-op when the source still
+        has the version the snapshot was converted from.
+        """
+        delay = self.interval
+        if self.state is None:
+            key = self.remote_path if self.remote else os.path.abspath(self.remote_path)
+            stale = latest_local_snapshot(key, self.cache_dir, self.columns) if self.interval else None
+            if stale is not None:
+                self.state = (stale, self.prepare(stale) if self.prepare is not None else None)
+                self._version = stale.version
+                delay = 0
+            else:
+                self.refresh()
+        if self.interval and self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, args=(delay,), name='snapshot-refresher', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,109 @@
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def _to_xyz(lat, lon):
+    """Points on the unit sphere, where straight-line distance tracks great-circle distance."""
+    lat, lon = np.radians(lat), np.radians(lon)
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+
+def _chord(radius_km):
+    return 2 * np.sin(np.minimum(radius_km / EARTH_RADIUS_KM, np.pi) / 2)
+
+
+def _arc_km(chord):
+    return 2 * np.arcsin(np.clip(chord / 2, 0, 1)) * EARTH_RADIUS_KM
+
+
+class SpatialIndex(object):
+    def __init__(self, data):
+        """
+        Radius, bounding-box and nearest-neighbour lookups over listing coordinates.
+
+        Coordinates are indexed in a KD-tree on the unit sphere, so radius
+        and k-nearest queries are exact great-circle searches. Latitudes are
+        also kept sorted for bounding-box queries. Every query returns row
+        positions of `data`, which compose with `ListingIndex.search`.
+
+        Parameters
+        ----------
+        data : pandas.DataFrame
+            Listings with `latitude` and `longitude` columns.
+        """
+        self.size = len(data)
+        lat = pd.to_numeric(data['latitude'], errors='coerce').to_numpy(dtype=float)
+        lon = pd.to_numeric(data['longitude'], errors='coerce').to_numpy(dtype=float)
+        valid = np.isfinite(lat) & np.isfinite(lon)
+        self.positions = np.flatnonzero(valid)
+        self.lat, self.lon = lat, lon
+        self.center = (float(lat[valid].mean()), float(lon[valid].mean())) if valid.any() else (0.0, 0.0)
+        self.tree = cKDTree(_to_xyz(lat[valid], lon[valid]))
+
+        order = np.argsort(lat[valid], kind='stable')
+        self.lat_sorted = lat[valid][order]
+        self.lat_order = self.positions[order]
+
+    def radius(self, lat, lon, radius_km):
+        """Positions of the listings within `radius_km` of (`lat`, `lon`), in table order."""
+        found = self.tree.query_ball_point(_to_xyz(lat, lon)[0], _chord(radius_km))
+        return np.sort(self.positions[np.asarray(found, dtype=int)])
+
+    def bbox(self, south, west, north, east):
+        """Positions of the listings inside a bounding box, which may cross the antimeridian."""
+        start = np.searchsorted(self.lat_sorted, south, side='left')
+        stop = np.searchsorted(self.lat_sorted, north, side='right')
+        candidates = self.lat_order[start:stop]
+        lon = self.lon[candidates]
+        if west <= east:
+            inside = (lon >= west) & (lon <= east)
+        else:
+            inside = (lon >= west) | (lon <= east)
+        return np.sort(candidates[inside])
+
+    def nearest(self, lat, lon, k, candidates=None):
+        """
+        The `k` listings closest to (`lat`, `lon`).
+
+        Parameters
+        ----------
+        candidates : numpy.ndarray, optional
+            Only consider these positions, e.g. the result of a search.
+
+        Returns
+        -------
+        tuple
+            `(positions, distances_km)`, closest first.
+        """
+        point = _to_xyz(lat, lon)[0]
+        n = len(self.positions)
+        if candidates is None:
+            allowed = None
+            wanted = min(k, n)
+        else:
+            allowed = np.zeros(self.size, dtype=bool)
+            allowed[candidates] = True
+            wanted = min(k, int(allowed[self.positions].sum()))
+        if wanted == 0:
+            return np.array([], dtype=int), np.array([])
+
+        # Widen the neighbourhood until enough of it passes the candidate filter
+        query_k = wanted
+        while True:
+            chord, idx = self.tree.query(point, k=min(query_k, n))
+            chord, idx = np.atleast_1d(chord), np.atleast_1d(idx)
+            positions = self.positions[idx]
+            if allowed is not None:
+                keep = allowed[positions]
+                chord, positions = chord[keep], positions[keep]
+            if len(positions) >= wanted or query_k >= n:
+                return positions[:wanted], _arc_km(chord[:wanted])
+            query_k *= 4
+
+    def distances_km(self, lat, lon, positions):
+        """Great-circle distance from (`lat`, `lon`) to the listings at `positions`."""
+        points = _to_xyz(self.lat[positions], self.lon[positions])
+        return _arc_km(np.linalg.norm(points - _to_xyz(lat, lon)[0], axis=1))